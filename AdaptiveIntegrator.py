@@ -0,0 +1,436 @@
+import logging
+import math
+import sys
+import time
+
+from numba import njit, double, prange
+
+from utils import *
+
+# step size bounds in segments, the fixed-step kernels always step SEGMENT_STEP
+ADAPTIVE_STEP_MIN: float = SEGMENT_STEP / 4
+ADAPTIVE_STEP_MAX: float = 1
+# a step never covers more than this share of the distance to the closest planet surface
+ADAPTIVE_CLEARANCE_SHARE: float = 0.5
+# tolerance of the converged adaptive run both kernels are compared against
+REFERENCE_TOLERANCE: float = 1e-7
+# flight time in segments between two polls of the hit flag in first hit mode
+FIRST_HIT_POLL_INTERVAL: float = FIRST_HIT_POLL_STEPS * SEGMENT_STEP
+
+
+@njit(nogil=True, cache=True)
+def planet_acceleration(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                        planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        x: float, y: float):
+    """
+    Returns the acceleration at (x, y) per segment and the distance to the closest planet surface,
+    which is not positive inside a planet.
+    """
+    ax = 0.0
+    ay = 0.0
+    clearance = math.inf
+    for i in range(planet_positions.shape[0]):
+        dx = planet_positions[i, 0] - x
+        dy = planet_positions[i, 1] - y
+        distance_sq = dx * dx + dy * dy
+        distance = math.sqrt(distance_sq)
+        clearance = min(clearance, distance - planet_radii[i])
+        if distance_sq > 0:
+            factor = planet_masses[i] / (distance_sq * distance)
+            ax += dx * factor
+            ay += dy * factor
+    return ax, ay, clearance
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def scan_list_adaptive(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                       planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                       planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                       start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                       target_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                       angle_list: np.ndarray,
+                       angle_count: int,
+                       velocity: double,
+                       tolerance: double,
+                       results: np.ndarray,
+                       found: np.ndarray,
+                       first_hit: bool):
+    steps = 0
+    for index in prange(angle_count):
+        steps += simulate_shot_adaptive(planet_positions=planet_positions,
+                                        planet_radii=planet_radii,
+                                        planet_masses=planet_masses,
+                                        start_position=start_position,
+                                        target_position=target_position,
+                                        angle=angle_list[index],
+                                        velocity=velocity,
+                                        tolerance=tolerance,
+                                        index=index,
+                                        results=results,
+                                        found=found,
+                                        first_hit=first_hit)
+    return steps
+
+
+@njit(nogil=True, cache=True)
+def simulate_shot_adaptive(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                           planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                           planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                           start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                           target_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                           angle: double,
+                           velocity: double,
+                           tolerance: double,
+                           index: int,
+                           results: np.ndarray,
+                           found: np.ndarray,
+                           first_hit: bool
+                           ):
+    """
+    Like simulate_shot, but integrates with a kick-drift-kick leapfrog whose step size adapts to the
+    change of the acceleration over a step. Steps whose estimated position error exceeds tolerance
+    are retried with half the step size, the step size doubles again in smooth regions.
+    Misses are measured against the whole path between two steps, not only the sample points.
+    Returns the number of integrated steps, including the retried ones.
+    """
+    x = start_position[0]
+    y = start_position[1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+    target_x = target_position[0]
+    target_y = target_position[1]
+
+    min_distance: float = math.sqrt((target_x - x) ** 2 + (target_y - y) ** 2)
+    left_source: bool = False
+
+    ax, ay, clearance = planet_acceleration(planet_positions, planet_radii, planet_masses, x, y)
+    elapsed = 0.0
+    step = SEGMENT_STEP
+    step_count = 0
+    # the steps vary in size, so the hit flag is polled by flight time, every FIRST_HIT_POLL_STEPS fixed steps
+    next_poll = FIRST_HIT_POLL_INTERVAL
+    while elapsed < MAX_SEGMENTS:
+        if clearance <= 0:
+            break
+
+        step_count += 1
+        if first_hit and elapsed >= next_poll:
+            if found[0] >= 0:
+                break
+            next_poll = elapsed + FIRST_HIT_POLL_INTERVAL
+
+        # small steps near planets, so that the missile cannot skip past a planet surface
+        speed = math.sqrt(vx * vx + vy * vy)
+        if speed > 0:
+            step = min(step, ADAPTIVE_CLEARANCE_SHARE * clearance / speed)
+        step = min(max(step, ADAPTIVE_STEP_MIN), ADAPTIVE_STEP_MAX, MAX_SEGMENTS - elapsed)
+
+        half_vx = vx + 0.5 * step * ax
+        half_vy = vy + 0.5 * step * ay
+        next_x = x + step * half_vx
+        next_y = y + step * half_vy
+        next_ax, next_ay, next_clearance = planet_acceleration(planet_positions, planet_radii, planet_masses,
+                                                               next_x, next_y)
+
+        # leading error term of the position, driven by the change of the acceleration over the step
+        error = 0.5 * step * step * math.sqrt((next_ax - ax) ** 2 + (next_ay - ay) ** 2)
+        if error > tolerance and step > ADAPTIVE_STEP_MIN:
+            step *= 0.5
+            continue
+
+        # closest approach to the target on the path of this step
+        seg_x = next_x - x
+        seg_y = next_y - y
+        seg_length = seg_x * seg_x + seg_y * seg_y
+        t = 0.0
+        if seg_length > 0:
+            t = min(max(((target_x - x) * seg_x + (target_y - y) * seg_y) / seg_length, 0.0), 1.0)
+        distance = math.sqrt((x + t * seg_x - target_x) ** 2 + (y + t * seg_y - target_y) ** 2)
+        min_distance = min(distance, min_distance)
+
+        x = next_x
+        y = next_y
+        vx = half_vx + 0.5 * step * next_ax
+        vy = half_vy + 0.5 * step * next_ay
+        ax = next_ax
+        ay = next_ay
+        clearance = next_clearance
+        elapsed += step
+
+        if left_source and distance <= PLAYER_SIZE:
+            found[0] = index
+            break
+
+        # check if missile returned to its source
+        self_distance = math.sqrt((x - start_position[0]) ** 2 + (y - start_position[1]) ** 2)
+        if left_source:
+            if self_distance <= PLAYER_SIZE:
+                break
+        elif self_distance > PLAYER_SIZE + 1.0:
+            left_source = True
+
+        # check if missile is out of bounds
+        if x < -MARGIN or \
+                x > BATTLE_FIELD_W + MARGIN or \
+                y < -MARGIN or \
+                y > BATTLE_FIELD_H + MARGIN:
+            break
+
+        if error < tolerance / 4:
+            step *= 2
+
+    results[index] = min_distance
+    return step_count
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def scan_list_adaptive_multi(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                             planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                             planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                             start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                             player_positions: np.ndarray(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                             active_mask: np.ndarray(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                             angle_list: np.ndarray,
+                             angle_count: int,
+                             velocity: double,
+                             tolerance: double,
+                             results: np.ndarray,
+                             hit_steps: np.ndarray,
+                             found: np.ndarray,
+                             first_hit: bool):
+    steps = 0
+    for index in prange(angle_count):
+        steps += simulate_shot_adaptive_multi(planet_positions=planet_positions,
+                                              planet_radii=planet_radii,
+                                              planet_masses=planet_masses,
+                                              start_position=start_position,
+                                              player_positions=player_positions,
+                                              active_mask=active_mask,
+                                              angle=angle_list[index],
+                                              velocity=velocity,
+                                              tolerance=tolerance,
+                                              index=index,
+                                              results=results,
+                                              hit_steps=hit_steps,
+                                              found=found,
+                                              first_hit=first_hit)
+    return steps
+
+
+@njit(nogil=True, cache=True)
+def simulate_shot_adaptive_multi(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                                 planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                                 planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                                 start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                                 player_positions: np.ndarray(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                                 active_mask: np.ndarray(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                                 angle: double,
+                                 velocity: double,
+                                 tolerance: double,
+                                 index: int,
+                                 results: np.ndarray,
+                                 hit_steps: np.ndarray,
+                                 found: np.ndarray,
+                                 first_hit: bool
+                                 ):
+    """
+    Like simulate_shot_adaptive, but for every active player at once like simulate_shot_multi.
+    The hit steps are counted in fixed steps of SEGMENT_STEP flight time, so that they compare
+    across shots. Returns the number of integrated steps, including the retried ones.
+    """
+    x = start_position[0]
+    y = start_position[1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+
+    for pid in range(player_positions.shape[0]):
+        if active_mask[pid]:
+            results[index, pid] = math.sqrt((player_positions[pid, 0] - x) ** 2 + (player_positions[pid, 1] - y) ** 2)
+        else:
+            results[index, pid] = math.inf
+        hit_steps[index, pid] = -1
+
+    left_source: bool = False
+
+    ax, ay, clearance = planet_acceleration(planet_positions, planet_radii, planet_masses, x, y)
+    elapsed = 0.0
+    step = SEGMENT_STEP
+    step_count = 0
+    next_poll = FIRST_HIT_POLL_INTERVAL
+    while elapsed < MAX_SEGMENTS:
+        if clearance <= 0:
+            break
+
+        step_count += 1
+        if first_hit and elapsed >= next_poll:
+            if found[0] >= 0:
+                break
+            next_poll = elapsed + FIRST_HIT_POLL_INTERVAL
+
+        # small steps near planets, so that the missile cannot skip past a planet surface
+        speed = math.sqrt(vx * vx + vy * vy)
+        if speed > 0:
+            step = min(step, ADAPTIVE_CLEARANCE_SHARE * clearance / speed)
+        step = min(max(step, ADAPTIVE_STEP_MIN), ADAPTIVE_STEP_MAX, MAX_SEGMENTS - elapsed)
+
+        half_vx = vx + 0.5 * step * ax
+        half_vy = vy + 0.5 * step * ay
+        next_x = x + step * half_vx
+        next_y = y + step * half_vy
+        next_ax, next_ay, next_clearance = planet_acceleration(planet_positions, planet_radii, planet_masses,
+                                                               next_x, next_y)
+
+        # leading error term of the position, driven by the change of the acceleration over the step
+        error = 0.5 * step * step * math.sqrt((next_ax - ax) ** 2 + (next_ay - ay) ** 2)
+        if error > tolerance and step > ADAPTIVE_STEP_MIN:
+            step *= 0.5
+            continue
+
+        # closest approach to every target on the path of this step
+        seg_x = next_x - x
+        seg_y = next_y - y
+        seg_length = seg_x * seg_x + seg_y * seg_y
+        hit = False
+        for pid in range(player_positions.shape[0]):
+            if not active_mask[pid]:
+                continue
+            t = 0.0
+            if seg_length > 0:
+                t = min(max(((player_positions[pid, 0] - x) * seg_x + (player_positions[pid, 1] - y) * seg_y) /
+                            seg_length, 0.0), 1.0)
+            distance = math.sqrt((x + t * seg_x - player_positions[pid, 0]) ** 2 +
+                                 (y + t * seg_y - player_positions[pid, 1]) ** 2)
+            results[index, pid] = min(distance, results[index, pid])
+            if left_source and distance <= PLAYER_SIZE:
+                hit_steps[index, pid] = int(math.ceil((elapsed + t * step) * SEGMENT_STEPS))
+                hit = True
+
+        x = next_x
+        y = next_y
+        vx = half_vx + 0.5 * step * next_ax
+        vy = half_vy + 0.5 * step * next_ay
+        ax = next_ax
+        ay = next_ay
+        clearance = next_clearance
+        elapsed += step
+
+        if hit:
+            found[0] = index
+            break
+
+        # check if missile returned to its source
+        self_distance = math.sqrt((x - start_position[0]) ** 2 + (y - start_position[1]) ** 2)
+        if left_source:
+            if self_distance <= PLAYER_SIZE:
+                break
+        elif self_distance > PLAYER_SIZE + 1.0:
+            left_source = True
+
+        # check if missile is out of bounds
+        if x < -MARGIN or \
+                x > BATTLE_FIELD_W + MARGIN or \
+                y < -MARGIN or \
+                y > BATTLE_FIELD_H + MARGIN:
+            break
+
+        if error < tolerance / 4:
+            step *= 2
+
+    return step_count
+
+
+def compare_integrators(tolerance, seed, angle_count, velocity_list=(8, 12, 16)):
+    """
+    Fires a full fan of shots at a player of a seeded map with the fixed-step and the adaptive kernel.
+    Returns the run times, the miss distance deviations between both kernels and from a converged
+    adaptive reference run, and the hits of both kernels.
+    """
+    from SimulationHandler import scan_list
+
+    planet_positions, planet_radii, planet_masses, player_positions = random_map(seed)
+    angle_list = np.linspace(0, 2 * math.pi, angle_count + 1)[:-1]
+    fixed = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    adaptive = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    reference = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    fixed_time = adaptive_time = 0
+    for row, velocity in enumerate(velocity_list):
+        start_time = time.time()
+        scan_list(planet_positions=planet_positions,
+                  planet_radii=planet_radii,
+                  planet_masses=planet_masses,
+                  **no_field_arrays(),
+                  start_position=player_positions[1],
+                  target_position=player_positions[0],
+                  angle_list=angle_list,
+                  angle_count=angle_count,
+                  velocity=float(velocity),
+                  results=fixed[row],
+                  found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                  first_hit=False)
+        fixed_time += time.time() - start_time
+
+        start_time = time.time()
+        scan_list_adaptive(planet_positions=planet_positions,
+                           planet_radii=planet_radii,
+                           planet_masses=planet_masses,
+                           start_position=player_positions[1],
+                           target_position=player_positions[0],
+                           angle_list=angle_list,
+                           angle_count=angle_count,
+                           velocity=float(velocity),
+                           tolerance=tolerance,
+                           results=adaptive[row],
+                           found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                           first_hit=False)
+        adaptive_time += time.time() - start_time
+
+        scan_list_adaptive(planet_positions=planet_positions,
+                           planet_radii=planet_radii,
+                           planet_masses=planet_masses,
+                           start_position=player_positions[1],
+                           target_position=player_positions[0],
+                           angle_list=angle_list,
+                           angle_count=angle_count,
+                           velocity=float(velocity),
+                           tolerance=REFERENCE_TOLERANCE,
+                           results=reference[row],
+                           found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                           first_hit=False)
+
+    deviation = np.abs(adaptive - fixed)
+    return {
+        "fixed_time": fixed_time,
+        "adaptive_time": adaptive_time,
+        "median_deviation": np.median(deviation),
+        "p90_deviation": np.percentile(deviation, 90),
+        "fixed_p90_error": np.percentile(np.abs(fixed - reference), 90),
+        "adaptive_p90_error": np.percentile(np.abs(adaptive - reference), 90),
+        "fixed_hits": int((fixed <= PLAYER_SIZE).sum()),
+        "adaptive_hits": int((adaptive <= PLAYER_SIZE).sum()),
+        "common_hits": int(((fixed <= PLAYER_SIZE) & (adaptive <= PLAYER_SIZE)).sum()),
+    }
+
+
+if __name__ == "__main__":
+    # divergence from the fixed-step kernel for a range of tolerances on seeded synthetic maps,
+    # the error columns compare both kernels against a converged adaptive run
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    tolerances = [float(arg) for arg in sys.argv[1:]] or [1e-1, 1e-2, 1e-3, 1e-4]
+    compare_integrators(tolerances[0], 0, 1)  # compile
+    columns = [("tolerance", ">9", "{:.0e}"), ("speedup", ">8", "{:.2f}x"), ("median dev", ">11", "{:.2e}"),
+               ("p90 dev", ">9", "{:.2e}"), ("p90 err fixed", ">14", "{:.2e}"),
+               ("p90 err adaptive", ">17", "{:.2e}"), ("fixed hits", ">11", "{}"),
+               ("adaptive hits", ">14", "{}"), ("common", ">7", "{}")]
+    print_row(columns)
+    for tolerance in tolerances:
+        reports = [compare_integrators(tolerance, seed, 720) for seed in range(3)]
+        print_row(columns, [tolerance,
+                            sum(r['fixed_time'] for r in reports) / sum(r['adaptive_time'] for r in reports),
+                            np.mean([r['median_deviation'] for r in reports]),
+                            np.mean([r['p90_deviation'] for r in reports]),
+                            np.mean([r['fixed_p90_error'] for r in reports]),
+                            np.mean([r['adaptive_p90_error'] for r in reports]),
+                            sum(r['fixed_hits'] for r in reports),
+                            sum(r['adaptive_hits'] for r in reports),
+                            sum(r['common_hits'] for r in reports)])
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from utils import *
+
+FAN_FILE_SUFFIX = ".fan"
+
+
+class FanCache:
+    """
+    On-disk cache of traced shot fans, keyed by a hash of everything a fan depends on.
+    Planet layouts and spawn positions repeat across rounds, so a fan traced once can be reused
+    by later rounds and restarts. The least recently used files are evicted above size_max bytes.
+
+    A fan file holds the int32 lengths of all shots followed by the float32 sample points,
+    truncated to the longest trajectory, and is loaded through a memory map.
+    """
+
+    def __init__(self, directory, size_max):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.size_max = size_max
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(*arrays):
+        digest = hashlib.sha1()
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(str(array.dtype).encode())
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + FAN_FILE_SUFFIX)
+
+    def load(self, key, points, lengths):
+        """
+        Copies the cached fan into points and lengths. Returns False on a cache miss.
+        """
+        # other bots may evict the file at any point, that is a miss as well
+        try:
+            return self.read(self.path(key), points, lengths)
+        except OSError:
+            return False
+
+    def read(self, path, points, lengths):
+        if not os.path.isfile(path):
+            return False
+
+        shot_count = lengths.size
+        header_size = lengths.nbytes
+        point_size = points.itemsize * 2 * shot_count
+        file_size = os.path.getsize(path)
+        if file_size < header_size or (file_size - header_size) % point_size:
+            self.logger.warning(f"Discarding malformed fan cache file {path}.")
+            os.remove(path)
+            return False
+        width = (file_size - header_size) // point_size
+        if width > points.shape[1]:
+            self.logger.warning(f"Discarding fan cache file {path} with too many samples per shot.")
+            os.remove(path)
+            return False
+
+        lengths[:] = np.memmap(path, dtype=np.int32, mode="r", shape=(shot_count,))
+        points[:, :width] = np.memmap(path, dtype=np.float32, mode="r", offset=header_size,
+                                      shape=(shot_count, width, 2))
+
+        # the modification time doubles as the last access time for the eviction
+        os.utime(path)
+        return True
+
+    def save(self, key, points, lengths):
+        width = int(lengths.max())
+        path = self.path(key)
+        # a unique temporary file per writer, bots tracing the same fan would truncate each other's otherwise
+        temp_file, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(temp_file, "wb") as fan_file:
+            fan_file.write(lengths.astype(np.int32).tobytes())
+            fan_file.write(np.ascontiguousarray(points[:, :width], dtype=np.float32).tobytes())
+        # rename last, so that concurrent readers never see a partial file
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        # files may disappear while other bots evict as well
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(FAN_FILE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total_size <= self.size_max:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            self.logger.info(f"Evicted {name} from fan cache.")
@@ -0,0 +1,462 @@
+"""
+Local stand-in for the game server, speaking the binary bot protocol AppleBot parses.
+
+Hosts any number of bot connections and static dummy players on a seeded synthetic map, fires the shots
+the bots send with the physics of the simulation and respawns hit players. Player moves and map changes
+follow a script, or happen periodically without one. At the end it reports the time from the last change
+of a player to the next shot of a bot at it and the message rates, so the network and scan pipeline
+can be load-tested without the real server. A shot is aimed at the player it passes closest to.
+
+A script holds one event per line, "<seconds> <command> [arguments]":
+    2.5 move 3 500 400      move player 3, to a random free position without coordinates
+    10 map 7                switch to the planets of seed 7 and move all players
+    12 join                 add a dummy player
+    15 leave 3              remove player 3
+
+Usage: python GameServer.py [duration] [bot count] [dummy count] [script file]
+"""
+import logging
+import math
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from numba import njit, double
+
+from main import IP, PORT
+from utils import *
+
+SERVER_DURATION = 60
+SERVER_BOTS = 1
+DUMMY_PLAYERS = 6
+ENERGY_START = 100
+# periodic events without a script, in seconds
+MOVE_INTERVAL = 3
+MAP_INTERVAL = 30
+
+
+class BotConnection:
+    """
+    Server side of one bot connection. Reads the text commands of the bot on its own thread.
+    """
+
+    def __init__(self, server, connection, address):
+        self.logger = logging.getLogger(__name__)
+        self.server = server
+        self.connection = connection
+        self.address = address
+        self.send_lock = threading.Lock()
+        self.connected = True
+
+        self.id = -1
+        self.name = ""
+        self.version = 0
+        self.velocity = 0.0
+        # time the bot was sent the latest change of each player, cleared by the next shot at that player
+        self.changed_at = {}
+
+        self.thread = threading.Thread(target=self.read_loop, name=f"bot-{address[1]}", daemon=True)
+
+    def send(self, data, changed_players=()):
+        with self.send_lock:
+            if not self.connected:
+                return
+            try:
+                self.connection.sendall(data)
+            except OSError:
+                self.connected = False
+                return
+            sent_at = time.perf_counter()
+            for player_id in changed_players:
+                self.changed_at[player_id] = sent_at
+
+    def read_loop(self):
+        with self.connection.makefile("r", encoding="UTF-8") as lines:
+            try:
+                for line in lines:
+                    line = line.strip()
+                    if line:
+                        self.handle_command(line)
+            except (OSError, ValueError):
+                pass
+        self.connected = False
+        self.server.disconnect(self)
+
+    def handle_command(self, line):
+        self.server.count_command()
+        command, _, argument = line.partition(" ")
+
+        # switch to bot mode and receive the game state
+        if command == "b":
+            self.version = int(argument)
+            self.server.join(self)
+
+        elif command == "n":
+            self.name = argument
+            self.logger.info(f"Player {self.id} is now called {self.name}.")
+
+        # clear own shots, nothing to clear without a display
+        elif command == "c":
+            pass
+
+        elif command == "v":
+            self.velocity = float(argument)
+
+        # a bare number fires at this angle in degrees
+        else:
+            try:
+                angle = float(line)
+            except ValueError:
+                self.logger.warning(f"Player {self.id} sent an unknown command: '{line}'")
+                return
+            self.server.fire(self, math.radians(angle), self.velocity, time.perf_counter())
+
+
+class GameServer:
+    def __init__(self, ip, port, seed=0, dummy_count=DUMMY_PLAYERS):
+        self.logger = logging.getLogger(__name__)
+        self.ip = ip
+        self.port = port
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.running = False
+
+        self.clients = {}
+        self.player_positions = {}
+        self.next_id = 0
+        self.planet_positions = np.zeros(dtype=np.float64, shape=(0, 2))
+        self.planet_radii = np.zeros(dtype=np.float64, shape=(0,))
+        self.planet_masses = np.zeros(dtype=np.float64, shape=(0,))
+        self.load_map(seed)
+        for _ in range(dummy_count):
+            self.add_player()
+
+        # statistics
+        self.start_time = time.perf_counter()
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.commands_received = 0
+        self.shots = 0
+        self.hits = 0
+        self.latencies = []
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def compile_functions(self):
+        compile_time = time.time()
+        self.logger.info("Compiling shot judge...")
+        fly_shot(planet_positions=self.planet_positions,
+                 planet_radii_sq=self.planet_radii ** 2,
+                 planet_gravity=self.planet_masses * SEGMENT_STEP,
+                 player_positions=np.zeros(dtype=np.float64, shape=(1, 2)),
+                 shooter=0,
+                 angle=0.0,
+                 velocity=1.0,
+                 points=np.zeros(dtype=np.float32, shape=(MAX_SEGMENTS + 1, 2)),
+                 approaches=np.zeros(dtype=np.float64, shape=(1,)))
+        self.logger.info(f"Compiling took {round(time.time() - compile_time, 3):04}s")
+
+    # GAME STATE
+
+    def load_map(self, seed):
+        self.planet_positions, self.planet_radii, self.planet_masses, _ = random_map(seed, player_count=0)
+
+    def free_position(self):
+        while True:
+            position = np.asarray([self.rng.uniform(0, BATTLE_FIELD_W), self.rng.uniform(0, BATTLE_FIELD_H)])
+            distances = np.sqrt(((self.planet_positions - position) ** 2).sum(axis=1))
+            if (distances > self.planet_radii + 2 * PLAYER_SIZE).all():
+                return position
+
+    def add_player(self):
+        with self.lock:
+            player_id = self.next_id
+            self.next_id += 1
+            self.player_positions[player_id] = self.free_position()
+            self.broadcast(player_message(player_id, self.player_positions[player_id]), (player_id,))
+        self.logger.info(f"Player {player_id} joined the game.")
+        return player_id
+
+    def remove_player(self, player_id):
+        with self.lock:
+            if self.player_positions.pop(player_id, None) is None:
+                return
+            self.broadcast(struct.pack("II", 2, player_id))
+        self.logger.info(f"Player {player_id} left the game.")
+
+    def move_player(self, player_id, position=None):
+        with self.lock:
+            if player_id not in self.player_positions:
+                return
+            self.player_positions[player_id] = self.free_position() if position is None else position
+            self.broadcast(player_message(player_id, self.player_positions[player_id]), (player_id,))
+
+    def change_map(self, seed):
+        with self.lock:
+            self.load_map(seed)
+            self.broadcast(planet_message(self.planet_positions, self.planet_radii, self.planet_masses))
+            for player_id in self.player_positions:
+                self.player_positions[player_id] = self.free_position()
+                self.broadcast(player_message(player_id, self.player_positions[player_id]), (player_id,))
+        self.logger.info(f"Map changed to seed {seed}.")
+
+    def fire(self, client, angle, velocity, received_at):
+        # judge the shot on a snapshot, so that other bots are not blocked during the flight
+        player_id = client.id
+        with self.lock:
+            if player_id not in self.player_positions:
+                return
+            player_ids = list(self.player_positions)
+            player_positions = np.asarray([self.player_positions[pid] for pid in player_ids])
+            planet_positions = self.planet_positions
+            planet_radii = self.planet_radii
+            planet_masses = self.planet_masses
+            self.broadcast(struct.pack("II", 5, player_id) + struct.pack("dd", angle, velocity))
+
+        points = np.zeros(dtype=np.float32, shape=(MAX_SEGMENTS + 1, 2))
+        approaches = np.full(dtype=np.float64, shape=(len(player_ids),), fill_value=math.inf)
+        hit, point_count = fly_shot(planet_positions=planet_positions,
+                                    planet_radii_sq=planet_radii ** 2,
+                                    planet_gravity=planet_masses * SEGMENT_STEP,
+                                    player_positions=player_positions,
+                                    shooter=player_ids.index(player_id),
+                                    angle=angle,
+                                    velocity=velocity,
+                                    points=points,
+                                    approaches=approaches)
+
+        with self.lock:
+            self.shots += 1
+            approaches[player_ids.index(player_id)] = math.inf
+            changed_at = client.changed_at.pop(player_ids[np.argmin(approaches)], None)
+            if changed_at is not None:
+                self.latencies.append(received_at - changed_at)
+            self.broadcast(struct.pack("II", 6, player_id) + struct.pack("ddI", angle, velocity, point_count) +
+                           points[:point_count].tobytes())
+            if hit >= 0:
+                self.hits += 1
+        if hit >= 0:
+            self.logger.info(f"Player {player_id} hit player {player_ids[hit]}.")
+            # respawn the hit player
+            self.move_player(player_ids[hit])
+
+    # CONNECTIONS
+
+    def broadcast(self, data, changed_players=()):
+        for client in list(self.clients.values()):
+            self.send(client, data, changed_players)
+
+    def send(self, client, data, changed_players=()):
+        client.send(data, changed_players)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def count_command(self):
+        with self.lock:
+            self.commands_received += 1
+
+    def join(self, client):
+        client.id = self.add_player()
+        with self.lock:
+            self.clients[client.id] = client
+            self.send(client, struct.pack("II", 1, client.id))
+            self.send(client, planet_message(self.planet_positions, self.planet_radii, self.planet_masses))
+            for player_id, position in self.player_positions.items():
+                self.send(client, player_message(player_id, position), (player_id,))
+            self.send(client, struct.pack("II", 8, client.id) + struct.pack("d", ENERGY_START))
+        self.logger.info(f"Bot at {client.address[0]}:{client.address[1]} joined as player {client.id} "
+                         f"(protocol version {client.version}).")
+
+    def disconnect(self, client):
+        with self.lock:
+            if self.clients.get(client.id) is not client:
+                return
+            del self.clients[client.id]
+        self.remove_player(client.id)
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, address = self.server_socket.accept()
+            except OSError:
+                break
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            BotConnection(self, connection, address).thread.start()
+
+    # SCENARIO
+
+    def load_script(self, path):
+        events = []
+        with open(path) as script:
+            for line in script:
+                line = line.split("#")[0].strip()
+                if line:
+                    at, command, *arguments = line.split()
+                    events.append((float(at), command, arguments))
+        return sorted(events, key=lambda event: event[0])
+
+    def periodic_events(self, duration):
+        events = []
+        for i in range(1, math.ceil(duration / MOVE_INTERVAL)):
+            events.append((i * MOVE_INTERVAL, "move", []))
+        for i in range(1, math.ceil(duration / MAP_INTERVAL)):
+            events.append((i * MAP_INTERVAL, "map", [str(i)]))
+        return sorted(events, key=lambda event: event[0])
+
+    def run_event(self, command, arguments):
+        if command == "move":
+            with self.lock:
+                player_ids = list(self.player_positions)
+            if not player_ids:
+                return
+            # a random player without arguments
+            player_id = int(arguments[0]) if arguments else player_ids[self.rng.integers(len(player_ids))]
+            position = np.asarray([float(arguments[1]), float(arguments[2])]) if len(arguments) > 2 else None
+            self.move_player(player_id, position)
+        elif command == "map":
+            self.change_map(int(arguments[0]))
+        elif command == "join":
+            self.add_player()
+        elif command == "leave":
+            self.remove_player(int(arguments[0]))
+        else:
+            self.logger.warning(f"Unknown script command: '{command}'")
+
+    def run(self, duration, events):
+        self.server_socket.bind((self.ip, self.port))
+        self.server_socket.listen()
+        self.running = True
+        threading.Thread(target=self.accept_loop, name="accept", daemon=True).start()
+        self.logger.info(f"Serving on {self.ip}:{self.port} for {duration}s.")
+
+        self.start_time = time.perf_counter()
+        for at, command, arguments in events:
+            if at >= duration:
+                break
+            time.sleep(max(0.0, self.start_time + at - time.perf_counter()))
+            self.run_event(command, arguments)
+        time.sleep(max(0.0, self.start_time + duration - time.perf_counter()))
+
+        self.running = False
+        self.server_socket.close()
+        with self.lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            client.connection.close()
+
+    def report(self):
+        run_time = time.perf_counter() - self.start_time
+        latencies = np.asarray(self.latencies)
+        return {
+            "run_time": run_time,
+            "shots": self.shots,
+            "hits": self.hits,
+            "shots_per_second": self.shots / run_time,
+            "messages_per_second": self.messages_sent / run_time,
+            "bytes_per_second": self.bytes_sent / run_time,
+            "commands_per_second": self.commands_received / run_time,
+            "median_latency": float(np.median(latencies)) if latencies.size else None,
+            "p90_latency": float(np.percentile(latencies, 90)) if latencies.size else None,
+        }
+
+
+def player_message(player_id, position):
+    return struct.pack("II", 3, player_id) + struct.pack("ff", *position)
+
+
+def planet_message(planet_positions, planet_radii, planet_masses):
+    planet_data = np.column_stack((planet_positions, planet_radii, planet_masses)).astype(np.float64)
+    return struct.pack("II", 9, len(planet_data)) + struct.pack("I", planet_data.nbytes) + planet_data.tobytes()
+
+
+@njit(nogil=True, cache=True)
+def fly_shot(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+             planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+             planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+             player_positions: np.ndarray,
+             shooter: int,
+             angle: double,
+             velocity: double,
+             points: np.ndarray,
+             approaches: np.ndarray):
+    """
+    Flies a missile with the physics of simulate_shot and checks it against all players,
+    the shooter only after the missile left it. Samples the path once per segment into points
+    and keeps the closest approach to every player in approaches.
+    Returns the index of the hit player or -1 and the number of samples.
+    """
+    x = player_positions[shooter, 0]
+    y = player_positions[shooter, 1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+
+    left_source: bool = False
+    point_count: int = 1
+    points[0, 0] = x
+    points[0, 1] = y
+
+    hit = -1
+    for step_count in range(1, MAX_SEGMENTS * SEGMENT_STEPS + 1):
+        vx, vy, collided = apply_gravity(planet_positions, planet_radii_sq, planet_gravity, x, y, vx, vy)
+        if collided:
+            break
+
+        # apply speed vector, shortened to segment
+        x += vx * SEGMENT_STEP
+        y += vy * SEGMENT_STEP
+
+        for player in range(player_positions.shape[0]):
+            distance = math.sqrt((player_positions[player, 0] - x) ** 2 + (player_positions[player, 1] - y) ** 2)
+            approaches[player] = min(approaches[player], distance)
+            if player == shooter and not left_source:
+                left_source = distance > PLAYER_SIZE + 1.0
+            elif distance <= PLAYER_SIZE:
+                hit = player
+                break
+
+        out_of_bounds = x < -MARGIN or \
+            x > BATTLE_FIELD_W + MARGIN or \
+            y < -MARGIN or \
+            y > BATTLE_FIELD_H + MARGIN
+
+        if hit >= 0 or out_of_bounds or step_count % SEGMENT_STEPS == 0:
+            points[point_count, 0] = x
+            points[point_count, 1] = y
+            point_count += 1
+            if hit >= 0 or out_of_bounds:
+                break
+
+    return hit, point_count
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else SERVER_DURATION
+    bot_count = int(sys.argv[2]) if len(sys.argv) > 2 else SERVER_BOTS
+    dummy_count = int(sys.argv[3]) if len(sys.argv) > 3 else DUMMY_PLAYERS
+
+    server = GameServer(IP, PORT, dummy_count=dummy_count)
+    server.compile_functions()
+    events = server.load_script(sys.argv[4]) if len(sys.argv) > 4 else server.periodic_events(duration)
+
+    # the bots run as separate processes, like against the real server
+    bots = [subprocess.Popen([sys.executable, "main.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(bot_count)]
+    try:
+        server.run(duration, events)
+    finally:
+        for bot in bots:
+            bot.terminate()
+
+    report = server.report()
+    print(f"run time:          {report['run_time']:.1f}s")
+    print(f"shots:             {report['shots']} ({report['hits']} hits, {report['shots_per_second']:.2f}/s)")
+    print(f"messages sent:     {report['messages_per_second']:.1f}/s ({report['bytes_per_second'] / 1024:.1f} KiB/s)")
+    print(f"commands received: {report['commands_per_second']:.1f}/s")
+    if report["median_latency"] is not None:
+        print(f"change to shot:    median {report['median_latency'] * 1000:.1f}ms, "
+              f"p90 {report['p90_latency'] * 1000:.1f}ms")
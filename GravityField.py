@@ -0,0 +1,205 @@
+import logging
+import math
+import sys
+import time
+
+from numba import njit, prange
+
+from PlanetClusters import apply_gravity_clustered
+from utils import *
+
+FIELD_SPAN_W: float = BATTLE_FIELD_W + 2 * MARGIN
+FIELD_SPAN_H: float = BATTLE_FIELD_H + 2 * MARGIN
+
+# cells closer than this to a planet surface fall back to direct summation
+FIELD_CUTOFF: float = 50
+
+
+class GravityField:
+    """
+    Acceleration of all planets, sampled on a grid spanning the battlefield including the margin.
+    The kernels interpolate it bilinearly instead of summing over all planets,
+    cells near a planet fall back to direct summation (which also handles collisions).
+    An empty grid makes the kernels use direct summation everywhere.
+    """
+
+    def __init__(self, cell_size):
+        self.logger = logging.getLogger(__name__)
+
+        # the actual cell size is slightly smaller so that the grid ends exactly at the margin
+        self.grid_w = int(math.ceil(FIELD_SPAN_W / cell_size)) + 1
+        self.grid_h = int(math.ceil(FIELD_SPAN_H / cell_size)) + 1
+
+        self.acceleration = np.zeros(dtype=np.float32, shape=(0, 0, 2))
+        self.near = np.zeros(dtype=np.bool_, shape=(0, 0))
+
+    def build(self, planet_positions, planet_radii, planet_masses):
+        build_time = time.time()
+
+        if self.acceleration.size == 0:
+            self.acceleration = np.zeros(dtype=np.float32, shape=(self.grid_h, self.grid_w, 2))
+            self.near = np.zeros(dtype=np.bool_, shape=(self.grid_h, self.grid_w))
+        compute_field(planet_positions=planet_positions,
+                      planet_radii=planet_radii,
+                      planet_masses=planet_masses,
+                      acceleration=self.acceleration,
+                      near=self.near)
+
+        build_time = time.time() - build_time
+        self.logger.info(f"Gravity field ({self.grid_w}x{self.grid_h}) took {round(build_time, 3):04}s, "
+                         f"{round(self.near.mean() * 100, 1)}% of cells use direct summation")
+
+    def accuracy_report(self, planet_positions, planet_radii, planet_masses, sample_count, seed=0):
+        """
+        Compares the interpolated acceleration against direct summation at random positions.
+        Returns the share of positions using direct summation and the relative errors of the others.
+        """
+        rng = np.random.default_rng(seed)
+        positions = np.column_stack((rng.uniform(-MARGIN, BATTLE_FIELD_W + MARGIN, sample_count),
+                                     rng.uniform(-MARGIN, BATTLE_FIELD_H + MARGIN, sample_count)))
+        errors = np.full(dtype=np.float64, shape=(sample_count,), fill_value=np.nan)
+        # compare against the plain field without clusters
+        no_clusters = no_field_arrays()
+        compare_field(planet_positions=planet_positions,
+                      planet_radii_sq=planet_radii * planet_radii,
+                      planet_gravity=planet_masses * SEGMENT_STEP,
+                      acceleration=self.acceleration,
+                      near=self.near,
+                      clusters=no_clusters["clusters"],
+                      cluster_bounds=no_clusters["cluster_bounds"],
+                      cluster_members=no_clusters["cluster_members"],
+                      positions=positions,
+                      errors=errors)
+
+        far_errors = errors[~np.isnan(errors)]
+        return {
+            "direct_share": 1 - far_errors.size / sample_count,
+            "mean_error": far_errors.mean(),
+            "p99_error": np.percentile(far_errors, 99),
+            "max_error": far_errors.max(),
+        }
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def compute_field(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                  planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  acceleration: np.ndarray,
+                  near: np.ndarray):
+    grid_h, grid_w = near.shape
+    cell_w = FIELD_SPAN_W / (grid_w - 1)
+    cell_h = FIELD_SPAN_H / (grid_h - 1)
+    for iy in prange(grid_h):
+        y = iy * cell_h - MARGIN
+        for ix in range(grid_w):
+            x = ix * cell_w - MARGIN
+            ax = 0.0
+            ay = 0.0
+            near[iy, ix] = False
+            for i in range(planet_positions.shape[0]):
+                dx = planet_positions[i, 0] - x
+                dy = planet_positions[i, 1] - y
+                distance_sq = dx * dx + dy * dy
+                if distance_sq > 0:
+                    factor = planet_masses[i] * SEGMENT_STEP / (distance_sq * math.sqrt(distance_sq))
+                    ax += dx * factor
+                    ay += dy * factor
+
+                # the cell spans to the next grid node, check if the planet plus cutoff reaches into it
+                cx = min(max(planet_positions[i, 0], x), x + cell_w) - planet_positions[i, 0]
+                cy = min(max(planet_positions[i, 1], y), y + cell_h) - planet_positions[i, 1]
+                if cx * cx + cy * cy <= (planet_radii[i] + FIELD_CUTOFF) ** 2:
+                    near[iy, ix] = True
+            acceleration[iy, ix, 0] = ax
+            acceleration[iy, ix, 1] = ay
+
+
+# inlined into the kernels, passing all arrays on every step is measurably slower
+@njit(nogil=True, cache=True, inline='always')
+def accelerate(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+               planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               acceleration: np.ndarray,
+               near: np.ndarray,
+               clusters: np.ndarray,
+               cluster_bounds: np.ndarray,
+               cluster_members: np.ndarray,
+               x: float, y: float, vx: float, vy: float):
+    """
+    Drop-in replacement for apply_gravity, interpolating the precomputed field where possible.
+    Elsewhere the planets are summed up directly, using the far-field approximation of the clusters if given.
+    """
+    grid_h, grid_w = near.shape
+    if grid_h == 0:
+        return apply_gravity_clustered(planet_positions, planet_radii_sq, planet_gravity,
+                                       clusters, cluster_bounds, cluster_members, x, y, vx, vy)
+
+    gx = (x + MARGIN) * (grid_w - 1) / FIELD_SPAN_W
+    gy = (y + MARGIN) * (grid_h - 1) / FIELD_SPAN_H
+    ix = min(max(int(gx), 0), grid_w - 2)
+    iy = min(max(int(gy), 0), grid_h - 2)
+    if near[iy, ix]:
+        return apply_gravity_clustered(planet_positions, planet_radii_sq, planet_gravity,
+                                       clusters, cluster_bounds, cluster_members, x, y, vx, vy)
+
+    # bilinear interpolation between the four surrounding grid nodes
+    fx = gx - ix
+    fy = gy - iy
+    w00 = (1 - fx) * (1 - fy)
+    w01 = fx * (1 - fy)
+    w10 = (1 - fx) * fy
+    w11 = fx * fy
+    vx += w00 * acceleration[iy, ix, 0] + w01 * acceleration[iy, ix + 1, 0] + \
+        w10 * acceleration[iy + 1, ix, 0] + w11 * acceleration[iy + 1, ix + 1, 0]
+    vy += w00 * acceleration[iy, ix, 1] + w01 * acceleration[iy, ix + 1, 1] + \
+        w10 * acceleration[iy + 1, ix, 1] + w11 * acceleration[iy + 1, ix + 1, 1]
+    return vx, vy, False
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def compare_field(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                  planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  acceleration: np.ndarray,
+                  near: np.ndarray,
+                  clusters: np.ndarray,
+                  cluster_bounds: np.ndarray,
+                  cluster_members: np.ndarray,
+                  positions: np.ndarray,
+                  errors: np.ndarray):
+    grid_h, grid_w = near.shape
+    for index in prange(positions.shape[0]):
+        x = positions[index, 0]
+        y = positions[index, 1]
+        ix = min(max(int((x + MARGIN) * (grid_w - 1) / FIELD_SPAN_W), 0), grid_w - 2)
+        iy = min(max(int((y + MARGIN) * (grid_h - 1) / FIELD_SPAN_H), 0), grid_h - 2)
+        # positions using direct summation are exact and stay nan
+        if near[iy, ix]:
+            continue
+        ax, ay, _ = accelerate(planet_positions, planet_radii_sq, planet_gravity, acceleration, near,
+                               clusters, cluster_bounds, cluster_members, x, y, 0.0, 0.0)
+        dx, dy, _ = apply_gravity(planet_positions, planet_radii_sq, planet_gravity, x, y, 0.0, 0.0)
+        errors[index] = math.sqrt((ax - dx) ** 2 + (ay - dy) ** 2) / math.sqrt(dx * dx + dy * dy)
+
+
+if __name__ == "__main__":
+    # accuracy report for a range of grid sizes on seeded synthetic maps
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    cell_sizes = [float(arg) for arg in sys.argv[1:]] or [1, 2, 4, 8, 16]
+    columns = [("cell", ">6", "{}"), ("grid", ">11", "{}"), ("MiB", ">7", "{:.1f}"), ("direct", ">7", "{:.1%}"),
+               ("mean err", ">10", "{:.2e}"), ("p99 err", ">10", "{:.2e}"), ("max err", ">10", "{:.2e}")]
+    print_row(columns)
+    for cell_size in cell_sizes:
+        reports = []
+        for seed in range(5):
+            planet_positions, planet_radii, planet_masses, _ = random_map(seed)
+            gravity_field = GravityField(cell_size)
+            gravity_field.build(planet_positions, planet_radii, planet_masses)
+            reports.append(gravity_field.accuracy_report(planet_positions, planet_radii, planet_masses, 100000, seed))
+        print_row(columns, [cell_size,
+                            f"{gravity_field.grid_w}x{gravity_field.grid_h}",
+                            gravity_field.acceleration.nbytes / 2 ** 20,
+                            np.mean([r['direct_share'] for r in reports]),
+                            np.mean([r['mean_error'] for r in reports]),
+                            np.mean([r['p99_error'] for r in reports]),
+                            np.max([r['max_error'] for r in reports])])
@@ -0,0 +1,257 @@
+import logging
+import math
+import sys
+import time
+
+from numba import njit, double, prange
+
+from utils import *
+
+# an experiment measured by `python LockstepIntegrator.py`, the bot scans with the multi-target kernels instead
+# shots advanced together per block, the planet loop runs over all lanes of a block at once
+LOCKSTEP_LANES: int = 8
+# float32 lanes are half as wide, so a block can hold twice as many shots at the same vector width
+LOCKSTEP_LANES_FLOAT32: int = 16
+
+
+def lockstep_planets(planet_positions, planet_radii, planet_masses, dtype=np.float64):
+    """
+    Returns the planet arrays scan_list_lockstep takes, with squared radii and masses divided by SEGMENT_STEPS,
+    in the precision of the lanes.
+    """
+    return (np.ascontiguousarray(planet_positions, dtype=dtype),
+            np.ascontiguousarray(planet_radii * planet_radii, dtype=dtype),
+            np.ascontiguousarray(planet_masses * SEGMENT_STEP, dtype=dtype))
+
+
+@njit(nogil=True, parallel=True, cache=True, error_model='numpy')
+def scan_list_lockstep(planet_positions: np.ndarray,
+                       planet_radii_sq: np.ndarray,
+                       planet_gravity: np.ndarray,
+                       start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                       target_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                       angle_list: np.ndarray,
+                       angle_count: int,
+                       velocity: double,
+                       segment_step,
+                       lanes: int,
+                       results: np.ndarray,
+                       found: np.ndarray,
+                       first_hit: bool):
+    """
+    Like scan_list, but every prange iteration advances a block of lanes shots in lockstep.
+    The missile states are kept as struct-of-arrays in the precision of the planet arrays (see lockstep_planets),
+    segment_step has to be a scalar of that precision as well. The planets are the outer loop of a step and
+    the lanes the inner one, so that the compiler can vectorize it. Shots that hit, collide or leave the
+    field are retired from the active mask, the block ends when no lane is left.
+    The float64 kernel matches scan_list without a gravity field or clusters exactly. In first hit mode the
+    lanes of a block run side by side, so a different one of several hitting shots may be reported.
+    Returns the number of integrated steps, counting retired lanes until their block ends.
+    """
+    steps = 0
+    for block in prange((angle_count + lanes - 1) // lanes):
+        steps += simulate_block(planet_positions=planet_positions,
+                                planet_radii_sq=planet_radii_sq,
+                                planet_gravity=planet_gravity,
+                                start_position=start_position,
+                                target_position=target_position,
+                                angle_list=angle_list,
+                                first=block * lanes,
+                                last=min(block * lanes + lanes, angle_count),
+                                velocity=velocity,
+                                segment_step=segment_step,
+                                results=results,
+                                found=found,
+                                first_hit=first_hit)
+    return steps
+
+
+@njit(nogil=True, cache=True, error_model='numpy')
+def simulate_block(planet_positions: np.ndarray,
+                   planet_radii_sq: np.ndarray,
+                   planet_gravity: np.ndarray,
+                   start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                   target_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                   angle_list: np.ndarray,
+                   first: int,
+                   last: int,
+                   velocity: double,
+                   segment_step,
+                   results: np.ndarray,
+                   found: np.ndarray,
+                   first_hit: bool):
+    lane_count = last - first
+    x = np.empty(dtype=planet_gravity.dtype, shape=(lane_count,))
+    y = np.empty(dtype=planet_gravity.dtype, shape=(lane_count,))
+    vx = np.empty(dtype=planet_gravity.dtype, shape=(lane_count,))
+    vy = np.empty(dtype=planet_gravity.dtype, shape=(lane_count,))
+    # smallest squared distance to a planet minus its squared radius, not positive on a collision
+    clearance = np.empty(dtype=planet_gravity.dtype, shape=(lane_count,))
+    min_distance = np.empty(dtype=np.float64, shape=(lane_count,))
+    active = np.ones(dtype=np.bool_, shape=(lane_count,))
+
+    target_x = target_position[0]
+    target_y = target_position[1]
+    start_distance = math.sqrt((target_x - start_position[0]) ** 2 + (target_y - start_position[1]) ** 2)
+    for lane in range(lane_count):
+        x[lane] = start_position[0]
+        y[lane] = start_position[1]
+        vx[lane] = velocity * math.cos(angle_list[first + lane])
+        vy[lane] = velocity * -math.sin(angle_list[first + lane])
+        min_distance[lane] = start_distance
+    left_source = np.zeros(dtype=np.bool_, shape=(lane_count,))
+    active_count = lane_count
+
+    step_count = 0
+    for step_count in range(1, MAX_SEGMENTS * SEGMENT_STEPS + 1):
+        # another shot of this launch already hit, stop early
+        if first_hit and step_count % FIRST_HIT_POLL_STEPS == 0 and found[0] >= 0:
+            break
+
+        # gravity of all planets on all lanes, retired lanes are computed along instead of branching
+        clearance[:] = np.inf
+        for i in range(planet_positions.shape[0]):
+            planet_x = planet_positions[i, 0]
+            planet_y = planet_positions[i, 1]
+            radius_sq = planet_radii_sq[i]
+            gravity = planet_gravity[i]
+            for lane in range(lane_count):
+                dx = planet_x - x[lane]
+                dy = planet_y - y[lane]
+                distance_sq = dx * dx + dy * dy
+                clearance[lane] = min(clearance[lane], distance_sq - radius_sq)
+                factor = gravity / (distance_sq * math.sqrt(distance_sq))
+                vx[lane] += dx * factor
+                vy[lane] += dy * factor
+
+        for lane in range(lane_count):
+            if not active[lane]:
+                continue
+            # collision with planet
+            if clearance[lane] <= 0:
+                active[lane] = False
+                active_count -= 1
+                continue
+
+            # apply speed vector, shortened to segment
+            x[lane] += vx[lane] * segment_step
+            y[lane] += vy[lane] * segment_step
+
+            # check if missile hit target player
+            distance = math.sqrt((target_x - x[lane]) ** 2 + (target_y - y[lane]) ** 2)
+            min_distance[lane] = min(distance, min_distance[lane])
+            if left_source[lane] and distance <= PLAYER_SIZE:
+                min_distance[lane] = distance
+                found[0] = first + lane
+                active[lane] = False
+                active_count -= 1
+                continue
+
+            # check if missile returned to its source
+            self_distance = math.sqrt((x[lane] - start_position[0]) ** 2 + (y[lane] - start_position[1]) ** 2)
+            if left_source[lane]:
+                if self_distance <= PLAYER_SIZE:
+                    active[lane] = False
+                    active_count -= 1
+                    continue
+            elif self_distance > PLAYER_SIZE + 1.0:
+                left_source[lane] = True
+
+            # check if missile is out of bounds
+            if x[lane] < -MARGIN or \
+                    x[lane] > BATTLE_FIELD_W + MARGIN or \
+                    y[lane] < -MARGIN or \
+                    y[lane] > BATTLE_FIELD_H + MARGIN:
+                active[lane] = False
+                active_count -= 1
+
+        if active_count == 0:
+            break
+
+    results[first:last] = min_distance
+    return step_count * lane_count
+
+
+def compare_lockstep(seed, angle_count, velocity_list=(8, 12, 16)):
+    """
+    Fires a full fan of shots at a player of a seeded map with scan_list and both lockstep precisions.
+    Returns the run times, the miss distance deviations from scan_list and the hits of all kernels.
+    """
+    from SimulationHandler import scan_list
+
+    planet_positions, planet_radii, planet_masses, player_positions = random_map(seed)
+    angle_list = np.linspace(0, 2 * math.pi, angle_count + 1)[:-1]
+    fixed = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    lockstep = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    lockstep_float32 = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    planets = lockstep_planets(planet_positions, planet_radii, planet_masses)
+    planets_float32 = lockstep_planets(planet_positions, planet_radii, planet_masses, np.float32)
+    times = {"fixed": 0.0, "lockstep": 0.0, "lockstep_float32": 0.0}
+    for row, velocity in enumerate(velocity_list):
+        start_time = time.time()
+        scan_list(planet_positions=planet_positions,
+                  planet_radii=planet_radii,
+                  planet_masses=planet_masses,
+                  **no_field_arrays(),
+                  start_position=player_positions[1],
+                  target_position=player_positions[0],
+                  angle_list=angle_list,
+                  angle_count=angle_count,
+                  velocity=float(velocity),
+                  results=fixed[row],
+                  found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                  first_hit=False)
+        times["fixed"] += time.time() - start_time
+
+        for name, (positions, radii_sq, gravity), dtype, lanes, results in (
+                ("lockstep", planets, np.float64, LOCKSTEP_LANES, lockstep),
+                ("lockstep_float32", planets_float32, np.float32, LOCKSTEP_LANES_FLOAT32, lockstep_float32)):
+            start_time = time.time()
+            scan_list_lockstep(planet_positions=positions,
+                               planet_radii_sq=radii_sq,
+                               planet_gravity=gravity,
+                               start_position=player_positions[1],
+                               target_position=player_positions[0],
+                               angle_list=angle_list,
+                               angle_count=angle_count,
+                               velocity=float(velocity),
+                               segment_step=dtype(SEGMENT_STEP),
+                               lanes=lanes,
+                               results=results[row],
+                               found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                               first_hit=False)
+            times[name] += time.time() - start_time
+
+    deviation = np.abs(lockstep_float32 - fixed)
+    return {
+        **{f"{name}_time": run_time for name, run_time in times.items()},
+        "max_deviation": np.abs(lockstep - fixed).max(),
+        "float32_median_deviation": np.median(deviation),
+        "float32_p90_deviation": np.percentile(deviation, 90),
+        "float32_max_deviation": deviation.max(),
+        "fixed_hits": int((fixed <= PLAYER_SIZE).sum()),
+        "float32_hits": int((lockstep_float32 <= PLAYER_SIZE).sum()),
+        "common_hits": int(((fixed <= PLAYER_SIZE) & (lockstep_float32 <= PLAYER_SIZE)).sum()),
+    }
+
+
+if __name__ == "__main__":
+    # speed and accuracy of both lockstep precisions against scan_list on seeded synthetic maps
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    seeds = [int(arg) for arg in sys.argv[1:]] or [0, 1, 2]
+    compare_lockstep(0, 1)  # compile
+    columns = [("seed", ">4", "{}"), ("speedup f64", ">12", "{:.2f}x"), ("speedup f32", ">12", "{:.2f}x"),
+               ("max dev f64", ">12", "{:.2e}"), ("median dev f32", ">15", "{:.2e}"),
+               ("p90 dev f32", ">12", "{:.2e}"), ("max dev f32", ">12", "{:.2e}"), ("hits", ">5", "{}"),
+               ("hits f32", ">9", "{}"), ("common", ">7", "{}")]
+    print_row(columns)
+    for seed in seeds:
+        report = compare_lockstep(seed, 720)
+        print_row(columns, [seed,
+                            report['fixed_time'] / report['lockstep_time'],
+                            report['fixed_time'] / report['lockstep_float32_time'],
+                            report['max_deviation'],
+                            report['float32_median_deviation'],
+                            report['float32_p90_deviation'],
+                            report['float32_max_deviation'],
+                            report['fixed_hits'], report['float32_hits'], report['common_hits']])
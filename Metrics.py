@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import *
+
+# upper bounds of the histogram buckets in seconds, doubling from 10µs to about 10s
+HISTOGRAM_BUCKETS = 1e-5 * 2.0 ** np.arange(21)
+HISTOGRAM_PERCENTILES = (50, 90, 99)
+METRICS_PREFIX = "applebot_"
+
+
+class Histogram:
+    """
+    Counts observations in the fixed HISTOGRAM_BUCKETS, the last bucket takes everything above.
+    Percentiles are interpolated within the buckets, so they are exact to about a factor of two
+    and the histograms of several bots can be added up.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(dtype=np.int64, shape=(HISTOGRAM_BUCKETS.size + 1,))
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[np.searchsorted(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        cumulative = np.cumsum(self.counts)
+        bucket = int(np.searchsorted(cumulative, rank))
+        if bucket >= HISTOGRAM_BUCKETS.size:
+            return float(HISTOGRAM_BUCKETS[-1])
+        lower = HISTOGRAM_BUCKETS[bucket - 1] if bucket else 0.0
+        below = cumulative[bucket - 1] if bucket else 0
+        return float(lower + (HISTOGRAM_BUCKETS[bucket] - lower) * (rank - below) / self.counts[bucket])
+
+
+class Metrics:
+    """
+    Thread-safe counters and latency histograms of one bot, identified by a name and optional labels.
+    They can be written to a JSON file periodically and served over HTTP,
+    as text at /metrics and as JSON at /metrics.json.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.server = None
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.start_time,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels),
+                                "count": histogram.count,
+                                "sum": histogram.sum,
+                                **{f"p{q}": histogram.percentile(q) for q in HISTOGRAM_PERCENTILES},
+                                "buckets": histogram.counts.tolist()}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+                "bucket_bounds": HISTOGRAM_BUCKETS.tolist(),
+            }
+
+    def to_text(self):
+        """
+        Returns all metrics in the Prometheus text format, histograms with cumulative buckets.
+        """
+        def label_text(labels, **extra):
+            labels = {**dict(labels), **extra}
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}" if labels else ""
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{METRICS_PREFIX}{name}_total{label_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = np.cumsum(histogram.counts)
+                for bound, count in zip(HISTOGRAM_BUCKETS, cumulative):
+                    lines.append(f"{METRICS_PREFIX}{name}_bucket{label_text(labels, le=f'{bound:.6g}')} {count}")
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{label_text(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"{METRICS_PREFIX}{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{METRICS_PREFIX}{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path + ".tmp", "w") as metrics_file:
+            json.dump(self.snapshot(), metrics_file, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def export(self, path, interval):
+        def export_loop():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        threading.Thread(target=export_loop, name="metrics-export", daemon=True).start()
+        self.logger.info(f"Writing metrics to {path} every {interval}s.")
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_text().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+        self.logger.info(f"Serving metrics on {host}:{port}.")
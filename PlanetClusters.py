@@ -0,0 +1,181 @@
+import logging
+import math
+import sys
+import time
+
+from numba import njit, prange
+
+from utils import *
+
+# a cluster is far if the missile is further away from its center of mass than this multiple of its extent,
+# the relative error of its far-field gravity is below about 1.5 / FAR_FIELD_RATIO ** 2
+FAR_FIELD_RATIO: float = 4
+
+
+class PlanetClusters:
+    """
+    Groups the planets into the cells of a uniform grid. Far from a cluster the kernels replace its planets
+    by a single point mass at their center of mass and skip their collision checks,
+    near it they sum over its planets directly.
+    The extent of a cluster covers the surfaces of all its planets, so a far cluster can not be hit.
+    Empty arrays make the kernels sum over all planets.
+    """
+
+    def __init__(self, cell_size):
+        self.logger = logging.getLogger(__name__)
+        self.cell_size = cell_size
+
+        # center x, center y, mass and extent of every cluster
+        self.clusters = np.zeros(dtype=np.float64, shape=(0, 4))
+        # the planets of cluster i are members[bounds[i]:bounds[i + 1]], stored contiguously
+        # as x, y, squared radius and mass divided by SEGMENT_STEPS like the kernel arguments
+        self.bounds = np.zeros(dtype=np.int32, shape=(1,))
+        self.members = np.zeros(dtype=np.float64, shape=(0, 4))
+
+    def build(self, planet_positions, planet_radii, planet_masses):
+        build_time = time.time()
+
+        cells = np.floor(planet_positions / self.cell_size).astype(np.int64)
+        cell_keys = cells[:, 0] * (1 << 32) + cells[:, 1]
+        order = np.argsort(cell_keys, kind="stable")
+        _, starts = np.unique(cell_keys[order], return_index=True)
+        self.bounds = np.append(starts, order.size).astype(np.int32)
+        self.members = np.column_stack((planet_positions[order],
+                                        planet_radii[order] ** 2,
+                                        planet_masses[order] * SEGMENT_STEP))
+
+        self.clusters = np.zeros(dtype=np.float64, shape=(starts.size, 4))
+        for cluster in range(starts.size):
+            planets = order[self.bounds[cluster]:self.bounds[cluster + 1]]
+            mass = planet_masses[planets].sum()
+            if mass > 0:
+                center = (planet_positions[planets] * planet_masses[planets, np.newaxis]).sum(axis=0) / mass
+            else:
+                center = planet_positions[planets].mean(axis=0)
+            distances = np.sqrt(((planet_positions[planets] - center) ** 2).sum(axis=1))
+            self.clusters[cluster] = (center[0], center[1], mass, (distances + planet_radii[planets]).max())
+
+        build_time = time.time() - build_time
+        self.logger.info(f"Planet clusters ({starts.size} clusters of {order.size} planets) "
+                         f"took {round(build_time, 3):04}s")
+
+    def accuracy_report(self, planet_positions, planet_radii, planet_masses, sample_count, seed=0):
+        """
+        Compares the clustered gravity against direct summation at random positions outside the planets.
+        Returns the cost relative to direct summation (clusters plus directly summed planets per planet)
+        and the relative errors.
+        """
+        rng = np.random.default_rng(seed)
+        positions = np.column_stack((rng.uniform(-MARGIN, BATTLE_FIELD_W + MARGIN, sample_count),
+                                     rng.uniform(-MARGIN, BATTLE_FIELD_H + MARGIN, sample_count)))
+        errors = np.full(dtype=np.float64, shape=(sample_count,), fill_value=np.nan)
+        evaluations = np.zeros(dtype=np.int64, shape=(sample_count,))
+        compare_clusters(planet_positions=planet_positions,
+                         planet_radii_sq=planet_radii * planet_radii,
+                         planet_gravity=planet_masses * SEGMENT_STEP,
+                         clusters=self.clusters,
+                         cluster_bounds=self.bounds,
+                         cluster_members=self.members,
+                         positions=positions,
+                         errors=errors,
+                         evaluations=evaluations)
+
+        errors = errors[~np.isnan(errors)]
+        return {
+            "relative_cost": evaluations.mean() / self.members.shape[0],
+            "mean_error": errors.mean(),
+            "p99_error": np.percentile(errors, 99),
+            "max_error": errors.max(),
+        }
+
+
+@njit(nogil=True, cache=True, inline='always')
+def apply_gravity_clustered(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                            planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                            planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                            clusters: np.ndarray,
+                            cluster_bounds: np.ndarray,
+                            cluster_members: np.ndarray,
+                            x: float, y: float, vx: float, vy: float):
+    """
+    Drop-in replacement for apply_gravity, using the far-field approximation of distant clusters.
+    Without clusters all planets are summed up directly.
+    """
+    if clusters.shape[0] == 0:
+        return apply_gravity(planet_positions, planet_radii_sq, planet_gravity, x, y, vx, vy)
+
+    for cluster in range(clusters.shape[0]):
+        dx = clusters[cluster, 0] - x
+        dy = clusters[cluster, 1] - y
+        distance_sq = dx * dx + dy * dy
+
+        # far cluster, attract towards its center of mass
+        if distance_sq > (FAR_FIELD_RATIO * clusters[cluster, 3]) ** 2:
+            factor = clusters[cluster, 2] * SEGMENT_STEP / (distance_sq * math.sqrt(distance_sq))
+            vx += dx * factor
+            vy += dy * factor
+            continue
+
+        for member in range(cluster_bounds[cluster], cluster_bounds[cluster + 1]):
+            dx = cluster_members[member, 0] - x
+            dy = cluster_members[member, 1] - y
+            distance_sq = dx * dx + dy * dy
+            if distance_sq <= cluster_members[member, 2]:
+                return vx, vy, True
+            factor = cluster_members[member, 3] / (distance_sq * math.sqrt(distance_sq))
+            vx += dx * factor
+            vy += dy * factor
+    return vx, vy, False
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def compare_clusters(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                     planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                     planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                     clusters: np.ndarray,
+                     cluster_bounds: np.ndarray,
+                     cluster_members: np.ndarray,
+                     positions: np.ndarray,
+                     errors: np.ndarray,
+                     evaluations: np.ndarray):
+    for index in prange(positions.shape[0]):
+        x = positions[index, 0]
+        y = positions[index, 1]
+        evaluations[index] = clusters.shape[0]
+        for cluster in range(clusters.shape[0]):
+            distance_sq = (clusters[cluster, 0] - x) ** 2 + (clusters[cluster, 1] - y) ** 2
+            if distance_sq <= (FAR_FIELD_RATIO * clusters[cluster, 3]) ** 2:
+                evaluations[index] += cluster_bounds[cluster + 1] - cluster_bounds[cluster]
+
+        # positions inside a planet stay nan
+        ax, ay, collided = apply_gravity_clustered(planet_positions, planet_radii_sq, planet_gravity,
+                                                   clusters, cluster_bounds, cluster_members, x, y, 0.0, 0.0)
+        dx, dy, collided_direct = apply_gravity(planet_positions, planet_radii_sq, planet_gravity, x, y, 0.0, 0.0)
+        if not (collided or collided_direct):
+            errors[index] = math.sqrt((ax - dx) ** 2 + (ay - dy) ** 2) / math.sqrt(dx * dx + dy * dy)
+
+
+if __name__ == "__main__":
+    # accuracy report for a range of cell sizes on seeded synthetic maps, optionally with more planets
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    planet_count = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PLANETS
+    cell_sizes = [float(arg) for arg in sys.argv[2:]] or [100, 200, 400, 800]
+    columns = [("cell", ">6", "{}"), ("clusters", ">9", "{:.1f}"), ("cost", ">7", "{:.1%}"),
+               ("mean err", ">10", "{:.2e}"), ("p99 err", ">10", "{:.2e}"), ("max err", ">10", "{:.2e}")]
+    print_row(columns)
+    for cell_size in cell_sizes:
+        reports = []
+        cluster_counts = []
+        for seed in range(5):
+            planet_positions, planet_radii, planet_masses, _ = random_map(seed, planet_count=planet_count)
+            planet_clusters = PlanetClusters(cell_size)
+            planet_clusters.build(planet_positions, planet_radii, planet_masses)
+            cluster_counts.append(planet_clusters.clusters.shape[0])
+            reports.append(planet_clusters.accuracy_report(planet_positions, planet_radii, planet_masses,
+                                                           100000, seed))
+        print_row(columns, [cell_size,
+                            np.mean(cluster_counts),
+                            np.mean([r['relative_cost'] for r in reports]),
+                            np.mean([r['mean_error'] for r in reports]),
+                            np.mean([r['p99_error'] for r in reports]),
+                            np.max([r['max_error'] for r in reports])])
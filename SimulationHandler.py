@@ -1,24 +1,21 @@
+import json
 import logging
 import math
 import time
 
-from numba import njit, double, prange, int16
+from numba import njit, double, prange
 
+from AdaptiveIntegrator import scan_list_adaptive, scan_list_adaptive_multi
+from FanCache import FanCache
+from GravityField import GravityField, compute_field, accelerate
+from Metrics import Metrics
+from PlanetClusters import PlanetClusters
+from TrajectoryStore import TrajectoryStore, trace_grid
 from utils import *
 
-A = 2e6
-BATTLE_FIELD_W: float = math.sqrt(A * 16 / 9)
-BATTLE_FIELD_H: float = math.sqrt(A * 9 / 16)
-PLAYER_SIZE: float = 4
-MARGIN: int = 500
-
-NUM_PLANETS: int = 24
-MAX_PLAYERS: int = 12
-MAX_SEGMENTS: int = 2000
-SEGMENT_STEPS: int = 25
-
 ENERGY_UPDATE_INTERVAL = 2
 # GENERAL SCAN SETTINGS
+# defaults of ScanConfig, a profile written by tune.py overrides them at runtime
 
 VELOCITY_DEFAULT = 12
 VELOCITY_CHANGES = [0, 2, -1, 1, -2, 3, 4]
@@ -26,83 +23,559 @@ VELOCITY_CHANGES = [0, 2, -1, 1, -2, 3, 4]
 # BROAD SCAN SETTINGS
 BROAD_STEPS = 60
 BROAD_TEST_CANDIDATES = 3
-BROAD_DISTANCE_MAX = 10
+# broad candidates missing the target by more than this are dropped, None keeps all of them
+BROAD_DISTANCE_MAX = None
 
 # FINE SCAN SETTINGS
-FINE_STEPS = 40
+# samples across ±one broad step, the best one brackets the refinement
+FINE_STEPS = 12
+# golden-section refinement of the miss distance
+REFINE_TOLERANCE = 1e-6
+REFINE_MAX_ITERATIONS = 40
+# velocity range searched if the angle refinement misses, 0 disables velocity refinement
+REFINE_VELOCITY_RANGE = 0
+# stop all shots of a fine scan as soon as one of them hits, the flag is polled every FIRST_HIT_POLL_STEPS steps,
+# see utils
+FIRST_HIT_MODE = True
+
+# ADAPTIVE INTEGRATOR SETTINGS
+# fine scans use adaptive time steps with this position error per step instead of SEGMENT_STEPS substeps,
+# see `python AdaptiveIntegrator.py` for the divergence from the fixed-step kernel
+ADAPTIVE_MODE = False
+ADAPTIVE_TOLERANCE = 1e-3
+
+# WARM START SETTINGS
+# the last solution for a target is refined first if neither we nor the target moved further than this
+WARM_START_DISTANCE_MAX = 30
+
+# TARGET SCHEDULING SETTINGS
+# broad candidates are refined in order of expected hits per cost. The hit likelihood falls off with the broad miss
+# as exp(-(miss / PROBE_MISS_SCALE)²), the cost grows with the segments flown to the closest approach
+# plus PROBE_COST_OFFSET for the launches of the refinement
+PROBE_MISS_SCALE = 150
+PROBE_COST_OFFSET = 40
+# targets none of whose candidates hit are skipped until they, we or the planets move
+UNREACHABLE_CACHE = True
+
+# SPECULATIVE SETTINGS
+# in concurrent mode the scan worker traces fans of SPECULATIVE_LEVELS times the broad angles from our own position
+# while there is nothing to scan, coarse to fine. Scans first try the closest shots of the finest complete fan,
+# each fan takes about 16 KiB per shot
+SPECULATIVE_MODE = False
+SPECULATIVE_LEVELS = (2, 4)
+# closest shots per target tried from the fan, only shots passing within SPECULATIVE_MISS_MAX of the target
+SPECULATIVE_CANDIDATES = 3
+SPECULATIVE_MISS_MAX = 4 * PLAYER_SIZE
+
+# GRAVITY FIELD SETTINGS
+# interpolate a precomputed acceleration field instead of summing over all planets,
+# see `python GravityField.py` for the accuracy of different cell sizes
+FIELD_MODE = False
+FIELD_CELL_SIZE = 4
+
+# PLANET CLUSTER SETTINGS
+# replace distant groups of planets by their center of mass and skip their collision checks,
+# see `python PlanetClusters.py` for the accuracy of different cell sizes
+CLUSTER_MODE = False
+CLUSTER_CELL_SIZE = 400
+
+# FAN CACHE SETTINGS
+# keep traced shot fans on disk, keyed by the planets and our own position
+FAN_CACHE = True
+FAN_CACHE_DIR = "fan_cache"
+FAN_CACHE_SIZE_MAX = 256 * 2 ** 20
+
+# KERNEL SETTINGS
+# JIT kernels are cached on disk, set this to use the serial kernels built by build_kernels.py instead
+AOT_KERNELS = False
+
+
+class ScanConfig:
+    """
+    The scan strategy settings SimulationHandler works with, initialized from the module constants.
+    segment_steps is compiled into the kernels, it is only recorded to reject profiles tuned for other kernels.
+    """
+    SETTINGS = ("velocity_default", "velocity_changes", "broad_steps", "broad_test_candidates",
+                "broad_distance_max", "fine_steps", "segment_steps")
+
+    def __init__(self, **settings):
+        self.velocity_default = VELOCITY_DEFAULT
+        self.velocity_changes = list(VELOCITY_CHANGES)
+        self.broad_steps = BROAD_STEPS
+        self.broad_test_candidates = BROAD_TEST_CANDIDATES
+        self.broad_distance_max = BROAD_DISTANCE_MAX
+        self.fine_steps = FINE_STEPS
+        self.segment_steps = SEGMENT_STEPS
+        for name, value in settings.items():
+            if name not in self.SETTINGS:
+                raise ValueError(f"Unknown scan setting '{name}'.")
+            setattr(self, name, value)
+        if self.segment_steps != SEGMENT_STEPS:
+            raise ValueError(f"Scan settings for {self.segment_steps} steps per segment, "
+                             f"the kernels are compiled for {SEGMENT_STEPS}.")
+
+    def velocity_list(self):
+        return [self.velocity_default + delta for delta in self.velocity_changes]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.SETTINGS}
+
+    def __repr__(self):
+        return f"ScanConfig({', '.join(f'{name}={value!r}' for name, value in self.to_dict().items())})"
+
+    @classmethod
+    def load(cls, path):
+        # settings missing from a profile written by tune.py keep their defaults
+        with open(path) as profile_file:
+            return cls(**json.load(profile_file)["settings"])
 
 
 class SimulationHandler:
-    def __init__(self, bot):
+    def __init__(self, bot, config=None):
         self.logger = logging.getLogger(__name__)
         self.bot = bot
+        self.config = config if config is not None else ScanConfig()
         self.initialized = False
-
-        self.player_positions: np.zeros(dtype=np.float64, shape=(MAX_PLAYERS, 2)) = \
-            np.zeros((MAX_PLAYERS, 2))
-        self.planet_positions: np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)) = \
-            np.zeros((NUM_PLANETS, 2))
-        self.planet_radii: np.ones(dtype=np.float64, shape=(NUM_PLANETS, 0)) = \
-            np.zeros((NUM_PLANETS,))
-        self.planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 0)) = \
-            np.zeros((NUM_PLANETS,))
+        # set by the network thread in concurrent mode when the running scan is outdated
+        self.cancel_scan = None
+        self.metrics = Metrics()
+
+        # sized to the map in update_field, indexed by player id and planet index
+        self.player_positions = np.zeros(dtype=np.float64, shape=(0, 2))
+        self.planet_positions = np.zeros(dtype=np.float64, shape=(0, 2))
+        self.planet_radii = np.zeros(dtype=np.float64, shape=(0,))
+        self.planet_masses = np.zeros(dtype=np.float64, shape=(0,))
+
+        # last hit per target: (angle, velocity, own position, target position), cleared when the planets change
+        self.solutions = {}
+        # targets none of the candidates hit: (own position, target position), cleared when the planets change
+        self.unreachable = {}
+
+        # empty unless FIELD_MODE is set, rebuilt when the planets change
+        self.field = GravityField(FIELD_CELL_SIZE)
+        # empty unless CLUSTER_MODE is set, rebuilt when the planets change
+        self.planet_clusters = PlanetClusters(CLUSTER_CELL_SIZE)
+
+        # broad scan fan, reused for every target until our position or the planets change
+        self.store = TrajectoryStore(angle_list=np.linspace(0, 2 * math.pi, self.config.broad_steps + 1)[:-1],
+                                     velocity_list=self.config.velocity_list(),
+                                     cache=FanCache(FAN_CACHE_DIR, FAN_CACHE_SIZE_MAX) if FAN_CACHE else None)
+        # finer fans traced in idle time, empty unless SPECULATIVE_MODE is set
+        self.speculative_stores = [
+            TrajectoryStore(angle_list=np.linspace(0, 2 * math.pi, self.config.broad_steps * level + 1)[:-1],
+                            velocity_list=self.config.velocity_list())
+            for level in (SPECULATIVE_LEVELS if SPECULATIVE_MODE else ())]
 
     def compile_functions(self):
+        if AOT_KERNELS:
+            import build_kernels
+            if build_kernels.install():
+                self.logger.info("Using ahead-of-time compiled kernels.")
+                return
+            self.logger.warning("Ahead-of-time compiled kernels not found, run build_kernels.py. Falling back to JIT.")
+
         self.logger.info("Gathering apples...")
         compile_time = time.time()
         scan_list(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
                   planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
                   planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  **no_field_arrays(),
                   start_position=np.zeros(dtype=np.float64, shape=(2,)),
                   target_position=np.ones(dtype=np.float64, shape=(2,)),
                   angle_list=np.zeros(dtype=np.float64, shape=(1,)),
                   angle_count=1,
-                  velocity=10,
-                  results=np.zeros(dtype=np.float64, shape=(1,)))
+                  velocity=10.0,
+                  results=np.zeros(dtype=np.float64, shape=(1,)),
+                  found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                  first_hit=True)
+        trace_grid(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                   planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                   planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                   **no_field_arrays(),
+                   start_position=np.zeros(dtype=np.float64, shape=(2,)),
+                   angle_list=np.zeros(dtype=np.float64, shape=(1,)),
+                   velocity_list=np.full(dtype=np.float64, shape=(1,), fill_value=10.0),
+                   points=np.zeros(dtype=np.float32, shape=(1, MAX_SEGMENTS + 1, 2)),
+                   lengths=np.zeros(dtype=np.int32, shape=(1,)))
+        scan_list_multi(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                        planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        **no_field_arrays(),
+                        start_position=np.zeros(dtype=np.float64, shape=(2,)),
+                        player_positions=np.ones(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                        active_mask=np.ones(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                        angle_list=np.zeros(dtype=np.float64, shape=(1,)),
+                        angle_count=1,
+                        velocity=10.0,
+                        results=np.zeros(dtype=np.float64, shape=(1, MAX_PLAYERS)),
+                        hit_steps=np.zeros(dtype=np.int32, shape=(1, MAX_PLAYERS)),
+                        found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                        first_hit=True)
+        compute_field(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                      planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                      planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                      acceleration=np.zeros(dtype=np.float32, shape=(2, 2, 2)),
+                      near=np.zeros(dtype=np.bool_, shape=(2, 2)))
+        scan_list_adaptive(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                           planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                           planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                           start_position=np.zeros(dtype=np.float64, shape=(2,)),
+                           target_position=np.ones(dtype=np.float64, shape=(2,)),
+                           angle_list=np.zeros(dtype=np.float64, shape=(1,)),
+                           angle_count=1,
+                           velocity=10.0,
+                           tolerance=1.0,
+                           results=np.zeros(dtype=np.float64, shape=(1,)),
+                           found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                           first_hit=True)
+        scan_list_adaptive_multi(planet_positions=np.zeros(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                                 planet_radii=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                                 planet_masses=np.zeros(dtype=np.float64, shape=(NUM_PLANETS,)),
+                                 start_position=np.zeros(dtype=np.float64, shape=(2,)),
+                                 player_positions=np.ones(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                                 active_mask=np.ones(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                                 angle_list=np.zeros(dtype=np.float64, shape=(1,)),
+                                 angle_count=1,
+                                 velocity=10.0,
+                                 tolerance=1.0,
+                                 results=np.zeros(dtype=np.float64, shape=(1, MAX_PLAYERS)),
+                                 hit_steps=np.zeros(dtype=np.int32, shape=(1, MAX_PLAYERS)),
+                                 found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                                 first_hit=True)
 
         compile_time = time.time() - compile_time
-        self.logger.info(f"Compilation took {round(compile_time, 3):04}s")
+        self.metrics.observe("compile_seconds", compile_time)
+        kernels = [scan_list, trace_grid, scan_list_multi, compute_field, scan_list_adaptive, scan_list_adaptive_multi]
+        compiled = [kernel.py_func.__name__ for kernel in kernels if not sum(kernel.stats.cache_hits.values())]
+        self.logger.info(f"Compilation took {round(compile_time, 3):04}s "
+                         f"({len(kernels) - len(compiled)} kernels loaded from cache, {len(compiled)} compiled)")
+        if compiled:
+            self.logger.info(f"Kernel cache miss for: {', '.join(compiled)}")
 
     def update_field(self):
-        # populate numpy arrays
-        for pid in range(MAX_PLAYERS):
+        # populate numpy arrays, they are only reallocated if the map does not fit anymore
+        player_count = max(self.bot.players, default=-1) + 1
+        if player_count > self.player_positions.shape[0]:
+            self.player_positions = np.zeros(dtype=np.float64, shape=(player_count, 2))
+        for pid in range(self.player_positions.shape[0]):
             if pid in self.bot.players:
                 self.player_positions[pid] = self.bot.players[pid].position
             else:
                 self.player_positions[pid] = np.zeros(dtype=np.float64, shape=(2,))
 
+        planet_data = (self.planet_positions.copy(), self.planet_radii.copy(), self.planet_masses.copy())
+        if len(self.bot.planets) != self.planet_positions.shape[0]:
+            self.planet_positions = np.zeros(dtype=np.float64, shape=(len(self.bot.planets), 2))
+            self.planet_radii = np.zeros(dtype=np.float64, shape=(len(self.bot.planets),))
+            self.planet_masses = np.zeros(dtype=np.float64, shape=(len(self.bot.planets),))
         for i, planet in enumerate(self.bot.planets):
             self.planet_positions[i] = planet.position
             self.planet_radii[i] = planet.radius
             self.planet_masses[i] = planet.mass
 
+        if not (np.array_equal(planet_data[0], self.planet_positions) and
+                np.array_equal(planet_data[1], self.planet_radii) and
+                np.array_equal(planet_data[2], self.planet_masses)):
+            self.solutions.clear()
+            self.unreachable.clear()
+            if CLUSTER_MODE:
+                self.planet_clusters.build(self.planet_positions, self.planet_radii, self.planet_masses)
+            if FIELD_MODE:
+                self.logger.info("Planets changed, rebuilding gravity field.")
+                self.field.build(self.planet_positions, self.planet_radii, self.planet_masses)
+
+        # trajectories only depend on our own position and the planets
+        if self.store.valid and not self.store.matches(self.player_positions[self.bot.id],
+                                                       self.planet_positions,
+                                                       self.planet_radii,
+                                                       self.planet_masses):
+            self.logger.info("Own position or planets changed, invalidating trajectory store.")
+            self.store.invalidate()
+        for store in self.speculative_stores:
+            if store.valid and not store.matches(self.player_positions[self.bot.id],
+                                                 self.planet_positions,
+                                                 self.planet_radii,
+                                                 self.planet_masses):
+                store.invalidate()
+
         self.initialized = True
 
-    def run_scanlist(self, target_id, angle_list, velocity):
+    def run_scanlist(self, target_id, angle_list, velocity, first_hit=FIRST_HIT_MODE):
+        # returns the miss distances and the index of a hit or -1, in first hit mode the miss distances
+        # after a hit are incomplete
         results = np.full(dtype=np.float64, shape=(angle_list.size,), fill_value=math.inf)
-        scan_list(planet_positions=self.planet_positions,
-                  planet_radii=self.planet_radii,
-                  planet_masses=self.planet_masses,
-                  start_position=self.player_positions[self.bot.id],
-                  target_position=self.player_positions[target_id],
-                  angle_list=angle_list,
-                  angle_count=angle_list.size,
-                  velocity=velocity,
-                  results=results)
-        return results
-
-    def check_for_relevant_update(self, target_id):
+        found = np.full(dtype=np.int64, shape=(1,), fill_value=-1)
+        if ADAPTIVE_MODE:
+            steps = scan_list_adaptive(planet_positions=self.planet_positions,
+                                       planet_radii=self.planet_radii,
+                                       planet_masses=self.planet_masses,
+                                       start_position=self.player_positions[self.bot.id],
+                                       target_position=self.player_positions[target_id],
+                                       angle_list=angle_list,
+                                       angle_count=angle_list.size,
+                                       velocity=velocity,
+                                       tolerance=ADAPTIVE_TOLERANCE,
+                                       results=results,
+                                       found=found,
+                                       first_hit=first_hit)
+            self.count_shots("fine", angle_list.size, steps)
+            return results, int(found[0])
+
+        steps = scan_list(planet_positions=self.planet_positions,
+                          planet_radii=self.planet_radii,
+                          planet_masses=self.planet_masses,
+                          acceleration=self.field.acceleration,
+                          near=self.field.near,
+                          clusters=self.planet_clusters.clusters,
+                          cluster_bounds=self.planet_clusters.bounds,
+                          cluster_members=self.planet_clusters.members,
+                          start_position=self.player_positions[self.bot.id],
+                          target_position=self.player_positions[target_id],
+                          angle_list=angle_list,
+                          angle_count=angle_list.size,
+                          velocity=velocity,
+                          results=results,
+                          found=found,
+                          first_hit=first_hit)
+        self.count_shots("fine", angle_list.size, steps)
+        return results, int(found[0])
+
+    def count_shots(self, scan, shot_count, steps):
+        self.metrics.count("shots_simulated", shot_count, scan=scan)
+        self.metrics.count("steps_integrated", steps, scan=scan)
+
+    def update_store(self):
+        if self.store.valid:
+            return
+        build_time = time.perf_counter()
+        steps = self.store.build(planet_positions=self.planet_positions,
+                                 planet_radii=self.planet_radii,
+                                 planet_masses=self.planet_masses,
+                                 acceleration=self.field.acceleration,
+                                 near=self.field.near,
+                                 clusters=self.planet_clusters.clusters,
+                                 cluster_bounds=self.planet_clusters.bounds,
+                                 cluster_members=self.planet_clusters.members,
+                                 start_position=self.player_positions[self.bot.id])
+        # a fan loaded from the cache integrates no steps
+        self.metrics.observe("broad_scan_seconds", time.perf_counter() - build_time,
+                             source="traced" if steps else "cache")
+        if steps:
+            self.count_shots("broad", self.store.shot_count, steps)
+
+    def broad_candidates(self, target_ids):
+        # best stored shots per velocity for every target, without those missing by more than broad_distance_max
+        candidate_lists = self.store.query_candidates(self.player_positions[target_ids],
+                                                      self.config.broad_test_candidates * self.store.velocity_list.size)
+        if self.config.broad_distance_max is None:
+            return candidate_lists
+        return [[candidate for candidate in candidates if candidate[2] <= self.config.broad_distance_max]
+                for candidates in candidate_lists]
+
+    def speculate(self, interrupted):
+        # traces the broad and speculative fans coarse to fine until interrupted() returns True,
+        # returns whether all fans are complete, an interrupted fan continues on the next call
+        self.update_store()
+        for store in self.speculative_stores:
+            if store.valid:
+                continue
+            if interrupted():
+                return False
+            with self.metrics.timer("speculate_seconds"):
+                steps = store.build(planet_positions=self.planet_positions,
+                                    planet_radii=self.planet_radii,
+                                    planet_masses=self.planet_masses,
+                                    acceleration=self.field.acceleration,
+                                    near=self.field.near,
+                                    clusters=self.planet_clusters.clusters,
+                                    cluster_bounds=self.planet_clusters.bounds,
+                                    cluster_members=self.planet_clusters.members,
+                                    start_position=self.player_positions[self.bot.id],
+                                    interrupted=interrupted)
+            self.metrics.count("steps_integrated", steps, scan="speculative")
+            if not store.valid:
+                return False
+            # index the fan now, instead of on the first query
+            store.build_index()
+            self.metrics.count("shots_simulated", store.shot_count, scan="speculative")
+            self.logger.info(f"Speculative fan of {store.shot_count} shots complete.")
+        return True
+
+    def speculative_result(self, target_ids, objective):
+        # fires the closest shots of the finest complete speculative fan one at a time, returns the first hit or None
+        store = next((store for store in reversed(self.speculative_stores) if store.valid), None)
+        if store is None:
+            return None
+        with self.metrics.timer("speculative_query_seconds"):
+            candidate_lists = store.query_candidates(self.player_positions[target_ids], SPECULATIVE_CANDIDATES)
+        for miss_distance, angle, velocity in sorted((miss_distance, angle, velocity)
+                                                     for candidates in candidate_lists
+                                                     for angle, velocity, miss_distance, _ in candidates
+                                                     if miss_distance <= SPECULATIVE_MISS_MAX):
+            _, result = self.evaluate(objective, angle, velocity)
+            if result is not None:
+                self.metrics.count("speculative_hits")
+                return result
+        return None
+
+    def run_scanlist_multi(self, target_ids, angle_list, velocity, first_hit=FIRST_HIT_MODE):
+        player_count = self.player_positions.shape[0]
+        active_mask = np.zeros(dtype=np.bool_, shape=(player_count,))
+        active_mask[target_ids] = True
+        results = np.full(dtype=np.float64, shape=(angle_list.size, player_count), fill_value=math.inf)
+        hit_steps = np.full(dtype=np.int32, shape=(angle_list.size, player_count), fill_value=-1)
+        found = np.full(dtype=np.int64, shape=(1,), fill_value=-1)
+        if ADAPTIVE_MODE:
+            steps = scan_list_adaptive_multi(planet_positions=self.planet_positions,
+                                             planet_radii=self.planet_radii,
+                                             planet_masses=self.planet_masses,
+                                             start_position=self.player_positions[self.bot.id],
+                                             player_positions=self.player_positions,
+                                             active_mask=active_mask,
+                                             angle_list=angle_list,
+                                             angle_count=angle_list.size,
+                                             velocity=velocity,
+                                             tolerance=ADAPTIVE_TOLERANCE,
+                                             results=results,
+                                             hit_steps=hit_steps,
+                                             found=found,
+                                             first_hit=first_hit)
+            self.count_shots("fine", angle_list.size, steps)
+            return results, hit_steps
+
+        steps = scan_list_multi(planet_positions=self.planet_positions,
+                                planet_radii=self.planet_radii,
+                                planet_masses=self.planet_masses,
+                                acceleration=self.field.acceleration,
+                                near=self.field.near,
+                                clusters=self.planet_clusters.clusters,
+                                cluster_bounds=self.planet_clusters.bounds,
+                                cluster_members=self.planet_clusters.members,
+                                start_position=self.player_positions[self.bot.id],
+                                player_positions=self.player_positions,
+                                active_mask=active_mask,
+                                angle_list=angle_list,
+                                angle_count=angle_list.size,
+                                velocity=velocity,
+                                results=results,
+                                hit_steps=hit_steps,
+                                found=found,
+                                first_hit=first_hit)
+        self.count_shots("fine", angle_list.size, steps)
+        return results, hit_steps
+
+    def refine(self, objective, test_angle, velocity):
+        # golden-section search over the angle (and optionally the velocity) around a broad scan candidate,
+        # objective(angle_list, velocity) returns the miss distances and the result of a hit or None
+        fine_steps = self.config.fine_steps
+        angle_range = 2 * math.pi / self.config.broad_steps
+        angle_list = np.linspace(test_angle - angle_range, test_angle + angle_range, fine_steps + 1)
+        results, result = objective(angle_list, velocity)
+        if result is not None:
+            return result
+
+        best_index = results.argmin()
+        angle, _, result = golden_section_search(
+            lambda x: self.evaluate(objective, x, velocity),
+            angle_list[max(best_index - 1, 0)], angle_list[min(best_index + 1, fine_steps)],
+            REFINE_TOLERANCE, REFINE_MAX_ITERATIONS)
+        if result is not None or not REFINE_VELOCITY_RANGE:
+            return result
+
+        velocity, _, result = golden_section_search(
+            lambda x: self.evaluate(objective, angle, x),
+            velocity - REFINE_VELOCITY_RANGE, velocity + REFINE_VELOCITY_RANGE,
+            REFINE_TOLERANCE, REFINE_MAX_ITERATIONS)
+        if result is not None:
+            return result
+
+        _, _, result = golden_section_search(
+            lambda x: self.evaluate(objective, x, velocity),
+            angle - angle_range / fine_steps, angle + angle_range / fine_steps,
+            REFINE_TOLERANCE, REFINE_MAX_ITERATIONS)
+        return result
+
+    @staticmethod
+    def evaluate(objective, angle, velocity):
+        results, result = objective(np.asarray([angle], dtype=np.float64), float(velocity))
+        return results[0], result
+
+    def remember_solution(self, target_id, angle, velocity):
+        self.solutions[target_id] = (angle, velocity,
+                                     self.player_positions[self.bot.id].copy(),
+                                     self.player_positions[target_id].copy())
+
+    def warm_start(self, target_ids):
+        # remembered solutions for target_ids, found with us and the target at nearly the same positions
+        candidates = []
+        for target_id in target_ids:
+            if target_id not in self.solutions:
+                continue
+            angle, velocity, own_position, target_position = self.solutions[target_id]
+            if dist(own_position, self.player_positions[self.bot.id]) <= WARM_START_DISTANCE_MAX and \
+                    dist(target_position, self.player_positions[target_id]) <= WARM_START_DISTANCE_MAX:
+                candidates.append((angle, velocity, target_id))
+        return candidates
+
+    def mark_unreachable(self, target_id):
+        if UNREACHABLE_CACHE:
+            self.logger.info(f"Player {target_id} cannot be hit from here.")
+            self.metrics.count("unreachable_verdicts")
+            self.unreachable[target_id] = (self.player_positions[self.bot.id].copy(),
+                                           self.player_positions[target_id].copy())
+
+    def reachable(self, target_ids):
+        # target_ids without those found unreachable at the current positions
+        reachable = []
+        for target_id in target_ids:
+            verdict = self.unreachable.get(target_id)
+            if verdict is None or (verdict[0] != self.player_positions[self.bot.id]).any() or \
+                    (verdict[1] != self.player_positions[target_id]).any():
+                reachable.append(target_id)
+        return reachable
+
+    @staticmethod
+    def expected_hits(miss_distance, segment):
+        # estimated hits per cost of refining a broad candidate, see PROBE_MISS_SCALE
+        return math.exp(-(miss_distance / PROBE_MISS_SCALE) ** 2) / (segment + PROBE_COST_OFFSET)
+
+    def is_outdated(self, target_ids):
+        # checks the bot state against the field the simulation works on, without updating it
+        for pid in [self.bot.id] + list(target_ids):
+            if pid not in self.bot.players or pid >= self.player_positions.shape[0] or \
+                    (self.bot.players[pid].position != self.player_positions[pid]).any():
+                return True
+        if len(self.bot.planets) != self.planet_positions.shape[0]:
+            return True
+        for i, planet in enumerate(self.bot.planets):
+            if (planet.position != self.planet_positions[i]).any() or \
+                    planet.radius != self.planet_radii[i] or planet.mass != self.planet_masses[i]:
+                return True
+        return False
+
+    def check_for_relevant_update(self, target_ids):
+        changed = self.drain_updates(target_ids)
+        if changed:
+            self.metrics.count("scan_aborts")
+        return changed
+
+    def drain_updates(self, target_ids):
+        # in concurrent mode the network thread keeps the state up to date and cancels outdated scans
+        if self.cancel_scan is not None:
+            return self.cancel_scan.is_set()
+
         self_pos = self.player_positions[self.bot.id].copy()
-        target_pos = self.player_positions[target_id].copy()
+        target_pos = self.player_positions[target_ids].copy()
         planet_pos = self.planet_positions.copy()
-        while self.bot.process_incoming():
-            pass
+        with self.metrics.timer("drain_seconds"):
+            while self.bot.process_incoming():
+                pass
         self.update_field()
-        if (self_pos != self.player_positions[self.bot.id]).all():
+        if (self_pos != self.player_positions[self.bot.id]).any():
             return True
-        if (target_pos != self.player_positions[target_id]).all():
+        if (target_pos != self.player_positions[target_ids]).any():
             return True
-        if (planet_pos != self.planet_positions).all():
+        if not np.array_equal(planet_pos, self.planet_positions):
             return True
         return False
 
@@ -113,152 +586,410 @@ class SimulationHandler:
         distance = np.sqrt(t_diff.dot(t_diff))
         self.logger.info(f"Target distance: {round(distance*1000/A)}% of A")
 
-        # broad scan
-        for velocity in [VELOCITY_DEFAULT + delta for delta in VELOCITY_CHANGES]:
-            self.logger.info(f"Starting broad scan with velocity {velocity}.")
-
-            # create angle list, remove last angle to avoid doubling 0 / 360°
-            angle_list = np.linspace(0, 2 * math.pi, BROAD_STEPS + 1)[:-1]
-            # run sim
-            results = self.run_scanlist(target_id, angle_list, velocity)
+        def objective(angle_list, velocity):
+            results, hit_index = self.run_scanlist(target_id, angle_list, velocity)
+            if hit_index >= 0:
+                return results, (angle_list[hit_index], velocity)
+            return results, None
+
+        # shots of the fan precomputed in idle time first
+        result = self.speculative_result([target_id], objective)
+        if result is not None:
+            found_angle, found_velocity = result
+            self.logger.info(f"Speculative fan hit with these parameters: "
+                             f"{round(math.degrees(found_angle), 2)}°, {found_velocity}")
+            self.remember_solution(target_id, found_angle, found_velocity)
+            return found_angle, found_velocity
+
+        # local search around the last solution before falling back to the broad scan
+        for test_angle, velocity, _ in self.warm_start([target_id]):
+            self.logger.info(f"Warm start from previous solution {round(math.degrees(test_angle), 2):05}° "
+                             f"with velocity {velocity}...")
+            with self.metrics.timer("fine_scan_seconds", start="warm"):
+                result = self.refine(objective, test_angle, velocity)
+            if result is not None:
+                found_angle, found_velocity = result
+                self.logger.info(
+                    f"Found trajectory with these parameters: {round(math.degrees(found_angle), 2)}°, {found_velocity}")
+                self.remember_solution(target_id, found_angle, found_velocity)
+                return found_angle, found_velocity
+            self.logger.info("Warm start failed, falling back to broad scan.")
+
+        # broad scan, looked up from the stored shot fan
+        self.update_store()
+        with self.metrics.timer("broad_query_seconds"):
+            candidates = self.broad_candidates([target_id])[0]
+
+        if not candidates:
+            self.logger.info("Broad scan yielded no viable angles.")
+            return -1
+        self.logger.info(f"Broad scan yielded {len(candidates)} viable angles.")
+
+        if self.check_for_relevant_update([target_id]):
+            self.logger.info("Situation changed, aborting simulation.")
+            return -2  # field changed
+
+        for test_angle, velocity, miss_distance, _ in sorted(candidates,
+                                                             key=lambda x: -self.expected_hits(x[2], x[3])):
+            self.logger.info(f"Exploring angle {round(math.degrees(test_angle), 2):05}° with velocity {velocity} "
+                             f"(broad miss: {round(miss_distance, 1)})...")
+            with self.metrics.timer("fine_scan_seconds", start="broad"):
+                result = self.refine(objective, test_angle, velocity)
+
+            if self.check_for_relevant_update([target_id]):
+                self.logger.info("Relevant information changed, aborting simulation.")
+                return -2  # field changed
 
-            sorted_angles = angle_list[results.argsort()][:BROAD_TEST_CANDIDATES]
-            sorted_angles = sorted_angles[sorted_angles < BROAD_DISTANCE_MAX]
+            if result is not None:
+                found_angle, found_velocity = result
+                self.logger.info(
+                    f"Found trajectory with these parameters: {round(math.degrees(found_angle), 2)}°, {found_velocity}")
+                self.remember_solution(target_id, found_angle, found_velocity)
+                return found_angle, found_velocity
 
-            if sorted_angles.size == 0:
-                self.logger.info("Scan yielded no viable angles at this velocity.")
-                continue
-            else:
-                self.logger.info(f"Scan yielded {len(sorted_angles)} viable angles.")
+        self.logger.info("No viable angles found for any of the broad scan candidates.")
+        return -1
 
-            if self.check_for_relevant_update(target_id):
-                self.logger.info("Situation changed, aborting simulation.")
+    def scan_opponents(self, target_ids):
+        # scores all targets in every fine scan, returns (target_id, angle, velocity) of the cheapest hit,
+        # -1 if no target can be hit or -2 if the field changed
+        self.logger.info(f"Now scanning for players {', '.join(str(target_id) for target_id in target_ids)}.")
+
+        # targets none of the shots reached before are only scanned again once something moved
+        reachable = self.reachable(target_ids)
+        if len(reachable) < len(target_ids):
+            self.metrics.count("unreachable_skips", len(target_ids) - len(reachable))
+        if not reachable:
+            self.logger.info("All targets are known to be unreachable.")
+            return -1
+        target_ids = reachable
+
+        def objective(target_id, angle_list, velocity):
+            results, hit_steps = self.run_scanlist_multi(target_ids, angle_list, velocity)
+            # prefer the hit that arrives first, in first hit mode only among the shots that were not cancelled
+            hit_steps = np.where(hit_steps < 0, np.iinfo(np.int32).max, hit_steps)
+            selected_index, hit_id = np.unravel_index(hit_steps.argmin(), hit_steps.shape)
+            if hit_steps[selected_index, hit_id] != np.iinfo(np.int32).max:
+                return results[:, target_id], (int(hit_id), angle_list[selected_index], velocity)
+            return results[:, target_id], None
+
+        # shots of the fan precomputed in idle time first, the hit may be on any of the targets
+        result = self.speculative_result(target_ids,
+                                         lambda angle_list, velocity: objective(target_ids[0], angle_list, velocity))
+        if result is not None:
+            return self.found_opponent(result)
+
+        # local search around the last solutions before falling back to the broad scan
+        for test_angle, velocity, target_id in self.warm_start(target_ids):
+            self.logger.info(f"Warm start from previous solution {round(math.degrees(test_angle), 2):05}° "
+                             f"with velocity {velocity} for player {target_id}...")
+            with self.metrics.timer("fine_scan_seconds", start="warm"):
+                result = self.refine(lambda angle_list, velocity: objective(target_id, angle_list, velocity),
+                                     test_angle, velocity)
+            if result is not None:
+                return self.found_opponent(result)
+        if self.solutions.keys() & set(target_ids):
+            self.logger.info("No warm start succeeded, falling back to broad scan.")
+
+        # broad scan, merge the candidates of all targets and drop shots suggested for several targets
+        self.update_store()
+        with self.metrics.timer("broad_query_seconds"):
+            candidate_lists = self.broad_candidates(target_ids)
+        candidates = {}
+        for target_id, target_candidates in zip(target_ids, candidate_lists):
+            for angle, velocity, miss_distance, segment in target_candidates:
+                if miss_distance < candidates.get((angle, velocity), (math.inf,))[0]:
+                    candidates[(angle, velocity)] = (miss_distance, target_id, segment)
+
+        # a target is unreachable once all of its candidates missed, but only if none of them was
+        # given to a closer target, those were refined against the other target only
+        remaining = {target_id: 0 for target_id in target_ids}
+        for _, target_id, _ in candidates.values():
+            remaining[target_id] += 1
+        complete = {target_id for target_id, target_candidates in zip(target_ids, candidate_lists)
+                    if remaining[target_id] == len(target_candidates)}
+        for target_id in complete:
+            if not remaining[target_id]:
+                self.mark_unreachable(target_id)
+
+        if not candidates:
+            self.logger.info("Broad scan yielded no viable angles.")
+            return -1
+        self.logger.info(f"Broad scan yielded {len(candidates)} viable angles.")
+
+        if self.check_for_relevant_update(target_ids):
+            self.logger.info("Situation changed, aborting simulation.")
+            return -2  # field changed
+
+        # most expected hits per cost first, across all targets
+        for (test_angle, velocity), (miss_distance, target_id, _) in sorted(
+                candidates.items(), key=lambda x: -self.expected_hits(x[1][0], x[1][2])):
+            self.logger.info(f"Exploring angle {round(math.degrees(test_angle), 2):05}° with velocity {velocity} "
+                             f"(broad miss: {round(miss_distance, 1)} to player {target_id})...")
+            with self.metrics.timer("fine_scan_seconds", start="broad"):
+                result = self.refine(lambda angle_list, velocity: objective(target_id, angle_list, velocity),
+                                     test_angle, velocity)
+
+            if self.check_for_relevant_update(target_ids):
+                self.logger.info("Relevant information changed, aborting simulation.")
                 return -2  # field changed
 
-            self.logger.info(
-                f"Starting fine scans for angles: {', '.join([f'{round(math.degrees(angle), 2):05}°' for angle in sorted_angles])}")
-            for test_angle in sorted_angles:
-                self.logger.info(f"Exploring angle {round(math.degrees(test_angle), 2):05}°...")
-                # create angle list, remove last angle to avoid doubling 0 / 360°
-                angle_range = 2 * math.pi / BROAD_STEPS
-                angle_list = np.linspace(test_angle - angle_range,
-                                         test_angle + angle_range,
-                                         FINE_STEPS + 1)[:-1]
-                results = self.run_scanlist(target_id, angle_list, velocity)
-
-                if self.check_for_relevant_update(target_id):
-                    self.logger.info("Relevant information changed, aborting simulation.")
-                    return -2  # field changed
-
-                if (results < PLAYER_SIZE).any():
-                    selected_index = np.where(results < PLAYER_SIZE)[0][0]
-                    found_angle = angle_list[selected_index]
-                    self.logger.info(
-                        f"Found trajectory with these parameters: {round(math.degrees(found_angle), 2)}°, {velocity}")
-                    return found_angle, velocity
-
-            self.logger.info("No viable angles found at this velocity.")
-
-        self.logger.info("No viable angles found at any of the scanned velocities.")
+            if result is not None:
+                return self.found_opponent(result)
+            remaining[target_id] -= 1
+            if not remaining[target_id] and target_id in complete:
+                self.mark_unreachable(target_id)
+
+        self.logger.info("No viable angles found for any target.")
         return -1
 
+    def found_opponent(self, result):
+        hit_id, found_angle, found_velocity = result
+        self.logger.info(
+            f"Found trajectory to player {hit_id} with these parameters: "
+            f"{round(math.degrees(found_angle), 2)}°, {found_velocity}")
+        self.remember_solution(hit_id, found_angle, found_velocity)
+        return result
+
 
-@njit(nogil=True, parallel=True)
+@njit(nogil=True, parallel=True, cache=True)
 def scan_list(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
               planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
               planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+              acceleration: np.ndarray,
+              near: np.ndarray,
+              clusters: np.ndarray,
+              cluster_bounds: np.ndarray,
+              cluster_members: np.ndarray,
               start_position: np.ndarray(dtype=np.float64, shape=(2,)),
               target_position: np.ndarray(dtype=np.float64, shape=(2,)),
               angle_list: np.ndarray,
               angle_count: int,
               velocity: double,
-              results: np.ndarray):
+              results: np.ndarray,
+              found: np.ndarray,
+              first_hit: bool):
+    # loop-invariant planet terms, computed once per launch
+    planet_radii_sq = planet_radii * planet_radii
+    planet_gravity = planet_masses * SEGMENT_STEP
+    steps = 0
     for index in prange(angle_count):
-        simulate_shot(planet_positions=planet_positions,
-                      planet_radii=planet_radii,
-                      planet_masses=planet_masses,
-                      start_position=start_position,
-                      target_position=target_position,
-                      angle=angle_list[index],
-                      velocity=velocity,
-                      index=index,
-                      results=results)
-
-
-@njit(nogil=True)
+        steps += simulate_shot(planet_positions=planet_positions,
+                               planet_radii_sq=planet_radii_sq,
+                               planet_gravity=planet_gravity,
+                               acceleration=acceleration,
+                               near=near,
+                               clusters=clusters,
+                               cluster_bounds=cluster_bounds,
+                               cluster_members=cluster_members,
+                               start_position=start_position,
+                               target_position=target_position,
+                               angle=angle_list[index],
+                               velocity=velocity,
+                               index=index,
+                               results=results,
+                               found=found,
+                               first_hit=first_hit)
+    return steps
+
+
+@njit(nogil=True, cache=True)
 def simulate_shot(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
-                  planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
-                  planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  acceleration: np.ndarray,
+                  near: np.ndarray,
+                  clusters: np.ndarray,
+                  cluster_bounds: np.ndarray,
+                  cluster_members: np.ndarray,
                   start_position: np.ndarray(dtype=np.float64, shape=(2,)),
                   target_position: np.ndarray(dtype=np.float64, shape=(2,)),
                   angle: double,
                   velocity: double,
                   index: int,
-                  results: np.ndarray
+                  results: np.ndarray,
+                  found: np.ndarray,
+                  first_hit: bool
                   ):
-    position = start_position.copy()
-    speed = np.asarray([velocity * math.cos(angle),
-                        velocity * -math.sin(angle)],
-                       dtype=np.float64)
-
+    # missile state is kept in scalars, nothing is allocated inside the loop
+    x = start_position[0]
+    y = start_position[1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+    target_x = target_position[0]
+    target_y = target_position[1]
+
+    min_distance: float = math.sqrt((target_x - x) ** 2 + (target_y - y) ** 2)
     left_source: bool = False
-    segment_count: int16 = 0
-    t_diff = target_position - start_position
-    min_distance: float = np.sqrt(t_diff.dot(t_diff))
-
-    while True:
-        for i in range(NUM_PLANETS):
-            # calculate vector and distance from planet to missile
-            tmp_v = planet_positions[i] - position
-            distance = np.sqrt(tmp_v.dot(tmp_v))
-
-            # collision with planet?
-            if distance <= planet_radii[i]:
-                results[index] = min_distance
-                return
 
-            # normalize tmp vector
-            tmp_v /= distance
-            # apply Newtonian Gravity
-            tmp_v *= planet_masses[i] / (distance ** 2)
-            # shortening to segment
-            tmp_v /= SEGMENT_STEPS
+    for step_count in range(1, MAX_SEGMENTS * SEGMENT_STEPS + 1):
+        # another shot of this launch already hit, stop early
+        if first_hit and step_count % FIRST_HIT_POLL_STEPS == 0 and found[0] >= 0:
+            results[index] = min_distance
+            return step_count
 
-            # add tmp vector to missile speed vector
-            speed += tmp_v
+        vx, vy, collided = accelerate(planet_positions, planet_radii_sq, planet_gravity,
+                                      acceleration, near, clusters, cluster_bounds, cluster_members,
+                                      x, y, vx, vy)
+        if collided:
+            results[index] = min_distance
+            return step_count
 
-        # shortening resulting speed to segment
-        tmp_v = speed / SEGMENT_STEPS
-        # apply speed vector
-        position += tmp_v
+        # apply speed vector, shortened to segment
+        x += vx * SEGMENT_STEP
+        y += vy * SEGMENT_STEP
 
         # check if missile hit target player
-        t_diff = target_position - position
-        s_diff = target_position - start_position
-        distance = np.sqrt(t_diff.dot(t_diff))
-        self_distance = np.sqrt(s_diff.dot(s_diff))
-
+        distance = math.sqrt((target_x - x) ** 2 + (target_y - y) ** 2)
         min_distance = min(distance, min_distance)
-        if left_source:
-            if distance <= PLAYER_SIZE:
-                results[index] = distance
-                return
-            elif self_distance <= PLAYER_SIZE:
-                results[index] = math.inf
-                return
+        if left_source and distance <= PLAYER_SIZE:
+            results[index] = distance
+            found[0] = index
+            return step_count
 
+        # check if missile returned to its source, like the server the hit test waits until it left it
+        self_distance = math.sqrt((x - start_position[0]) ** 2 + (y - start_position[1]) ** 2)
+        if left_source:
+            if self_distance <= PLAYER_SIZE:
+                results[index] = min_distance
+                return step_count
         elif self_distance > PLAYER_SIZE + 1.0:
             left_source = True
 
         # check if missile is out of bounds
-        if position[0] < -MARGIN or \
-                position[0] > BATTLE_FIELD_W + MARGIN or \
-                position[1] < -MARGIN or \
-                position[1] > BATTLE_FIELD_H + MARGIN:
+        if x < -MARGIN or \
+                x > BATTLE_FIELD_W + MARGIN or \
+                y < -MARGIN or \
+                y > BATTLE_FIELD_H + MARGIN:
             results[index] = min_distance
-            return
+            return step_count
+
+    # missile trail is too long
+    results[index] = min_distance
+    return MAX_SEGMENTS * SEGMENT_STEPS
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def scan_list_multi(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                    planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                    planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                    acceleration: np.ndarray,
+                    near: np.ndarray,
+                    clusters: np.ndarray,
+                    cluster_bounds: np.ndarray,
+                    cluster_members: np.ndarray,
+                    start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                    player_positions: np.ndarray(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                    active_mask: np.ndarray(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                    angle_list: np.ndarray,
+                    angle_count: int,
+                    velocity: double,
+                    results: np.ndarray,
+                    hit_steps: np.ndarray,
+                    found: np.ndarray,
+                    first_hit: bool):
+    planet_radii_sq = planet_radii * planet_radii
+    planet_gravity = planet_masses * SEGMENT_STEP
+    steps = 0
+    for index in prange(angle_count):
+        steps += simulate_shot_multi(planet_positions=planet_positions,
+                                     planet_radii_sq=planet_radii_sq,
+                                     planet_gravity=planet_gravity,
+                                     acceleration=acceleration,
+                                     near=near,
+                                     clusters=clusters,
+                                     cluster_bounds=cluster_bounds,
+                                     cluster_members=cluster_members,
+                                     start_position=start_position,
+                                     player_positions=player_positions,
+                                     active_mask=active_mask,
+                                     angle=angle_list[index],
+                                     velocity=velocity,
+                                     index=index,
+                                     results=results,
+                                     hit_steps=hit_steps,
+                                     found=found,
+                                     first_hit=first_hit)
+    return steps
+
+
+@njit(nogil=True, cache=True)
+def simulate_shot_multi(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                        planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                        acceleration: np.ndarray,
+                        near: np.ndarray,
+                        clusters: np.ndarray,
+                        cluster_bounds: np.ndarray,
+                        cluster_members: np.ndarray,
+                        start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+                        player_positions: np.ndarray(dtype=np.float64, shape=(MAX_PLAYERS, 2)),
+                        active_mask: np.ndarray(dtype=np.bool_, shape=(MAX_PLAYERS,)),
+                        angle: double,
+                        velocity: double,
+                        index: int,
+                        results: np.ndarray,
+                        hit_steps: np.ndarray,
+                        found: np.ndarray,
+                        first_hit: bool
+                        ):
+    # like simulate_shot, but for every active player at once, the shot ends at the first player it hits
+    x = start_position[0]
+    y = start_position[1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+
+    for pid in range(player_positions.shape[0]):
+        if active_mask[pid]:
+            results[index, pid] = math.sqrt((player_positions[pid, 0] - x) ** 2 + (player_positions[pid, 1] - y) ** 2)
+        else:
+            results[index, pid] = math.inf
+        hit_steps[index, pid] = -1
 
-        # check if missile trail is too long
-        if segment_count >= MAX_SEGMENTS:
-            results[index] = min_distance
-            return
+    left_source: bool = False
+
+    for step_count in range(1, MAX_SEGMENTS * SEGMENT_STEPS + 1):
+        if first_hit and step_count % FIRST_HIT_POLL_STEPS == 0 and found[0] >= 0:
+            return step_count
+
+        vx, vy, collided = accelerate(planet_positions, planet_radii_sq, planet_gravity,
+                                      acceleration, near, clusters, cluster_bounds, cluster_members,
+                                      x, y, vx, vy)
+        if collided:
+            return step_count
+
+        # apply speed vector, shortened to segment
+        x += vx * SEGMENT_STEP
+        y += vy * SEGMENT_STEP
+
+        # check if missile hit any of the target players
+        hit = False
+        for pid in range(player_positions.shape[0]):
+            if not active_mask[pid]:
+                continue
+            distance = math.sqrt((player_positions[pid, 0] - x) ** 2 + (player_positions[pid, 1] - y) ** 2)
+            results[index, pid] = min(distance, results[index, pid])
+            if left_source and distance <= PLAYER_SIZE:
+                hit_steps[index, pid] = step_count
+                hit = True
+        if hit:
+            found[0] = index
+            return step_count
+
+        # check if missile returned to its source
+        self_distance = math.sqrt((x - start_position[0]) ** 2 + (y - start_position[1]) ** 2)
+        if left_source:
+            if self_distance <= PLAYER_SIZE:
+                return step_count
+        elif self_distance > PLAYER_SIZE + 1.0:
+            left_source = True
+
+        # check if missile is out of bounds
+        if x < -MARGIN or \
+                x > BATTLE_FIELD_W + MARGIN or \
+                y < -MARGIN or \
+                y > BATTLE_FIELD_H + MARGIN:
+            return step_count
+
+    # missile trail is too long
+    return MAX_SEGMENTS * SEGMENT_STEPS
@@ -4,11 +4,18 @@ import struct
 import sys
 import time
 
+import numpy as np
 from spinners import Spinners
 
+RECV_BUFFER_SIZE = 1 << 16
+# a capture file starts with CAPTURE_MAGIC, followed by one record per received chunk:
+# the seconds since the capture started and the chunk size as CAPTURE_RECORD, then the chunk itself
+CAPTURE_MAGIC = b"APPLECAP1"
+CAPTURE_RECORD = "<dI"
+
 
 class SocketManager:
-    def __init__(self, ip, port, retry_interval, version, recv_timeout):
+    def __init__(self, ip, port, retry_interval, version, recv_timeout, capture_path=None):
         self.logger = logging.getLogger(__name__)
 
         # set up socket and establish connection
@@ -20,43 +27,121 @@ class SocketManager:
         self.bot_ver = version
         self.recv_timeout = recv_timeout
 
+        # receive buffer, filled with large reads and consumed from buffer_start to buffer_end
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.buffer_start = 0
+        self.buffer_end = 0
+
+        # optional capture of the received byte stream, for a later replay
+        self.capture_path = capture_path
+        self.capture = None
+        self.capture_start = 0
+
     def initialize(self):
         self.establish_connection()
         self.discard_all(1)
+        self.socket.settimeout(self.recv_timeout)
+        if self.capture_path is not None:
+            self.start_capture()
         self.send_str(f"b {self.bot_ver}")
 
+    def start_capture(self):
+        self.capture = open(self.capture_path, "wb")
+        self.capture.write(CAPTURE_MAGIC)
+        self.capture_start = time.perf_counter()
+        self.logger.info(f"Capturing received data to {self.capture_path}.")
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
     # receives and discards all packages until it times out
     def discard_all(self, discard_timeout=1):
+        self.buffer_start = self.buffer_end = 0
         timeout = self.socket.gettimeout()
         self.socket.settimeout(discard_timeout)
         while True:
             try:
-                self.socket.recv(4096)
+                self.socket.recv_into(self.view)
             except TimeoutError:
                 break
         self.socket.settimeout(timeout)
 
-    def receive_bytes(self, byte_count):
-        timeout = self.socket.gettimeout()
-        self.socket.settimeout(self.recv_timeout)
-
-        buf = b''
-        while byte_count:
+    def fill(self, byte_count):
+        """
+        Reads from the socket until at least byte_count bytes are buffered.
+        Returns False if the socket timed out before, the buffered data is kept.
+        """
+        while self.buffer_end - self.buffer_start < byte_count:
+            # make room at the end of the buffer
+            if self.buffer_start + byte_count > len(self.buffer):
+                self.compact(byte_count)
             try:
-                new_buf = self.socket.recv(byte_count)
-                if not new_buf:
-                    self.logger.error("Connection dropped unexpectedly during RECV.")
-                    exit(1)
-
-                buf += new_buf
-                byte_count -= len(new_buf)
+                new_bytes = self.socket.recv_into(self.view[self.buffer_end:])
             except TimeoutError:
-                buf = None
-                break
+                return False
+            if not new_bytes:
+                self.logger.error("Connection dropped unexpectedly during RECV.")
+                self.stop_capture()
+                exit(1)
+            if self.capture is not None:
+                self.capture.write(struct.pack(CAPTURE_RECORD, time.perf_counter() - self.capture_start, new_bytes))
+                self.capture.write(self.view[self.buffer_end:self.buffer_end + new_bytes])
+            self.buffer_end += new_bytes
+        return True
 
-        self.socket.settimeout(timeout)
+    def wait(self, byte_count):
+        """
+        Like fill, but retries timed out reads. The payload of a message whose header arrived has to be read
+        completely, or the stream loses its position. Returns False if the connection ended before.
+        """
+        while not self.fill(byte_count):
+            if not self.connected:
+                return False
+        return True
+
+    def compact(self, byte_count):
+        buffered = self.buffer_end - self.buffer_start
+        if byte_count > len(self.buffer):
+            # grow the buffer for large payloads, the view has to be released first
+            self.view.release()
+            self.buffer = self.buffer[self.buffer_start:self.buffer_end] + bytearray(byte_count - buffered)
+            self.view = memoryview(self.buffer)
+        else:
+            self.buffer[:buffered] = self.buffer[self.buffer_start:self.buffer_end]
+        self.buffer_start = 0
+        self.buffer_end = buffered
+
+    def buffered(self):
+        return self.buffer_end - self.buffer_start
+
+    def receive_bytes(self, byte_count, wait=False):
+        if not (self.wait(byte_count) if wait else self.fill(byte_count)):
+            return None
+        buf = bytes(self.view[self.buffer_start:self.buffer_start + byte_count])
+        self.buffer_start += byte_count
         return buf
 
+    def receive_array(self, dtype, count, wait=False):
+        """
+        Decodes count values of dtype in bulk. Returns None if the socket timed out, with wait only if
+        the connection ended.
+        """
+        byte_count = np.dtype(dtype).itemsize * count
+        if not (self.wait(byte_count) if wait else self.fill(byte_count)):
+            return None
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.buffer_start).copy()
+        self.buffer_start += byte_count
+        return array
+
+    def skip(self, byte_count, wait=False):
+        if not (self.wait(byte_count) if wait else self.fill(byte_count)):
+            return False
+        self.buffer_start += byte_count
+        return True
+
     def send_str(self, string):
         # trim whitespaces and add newline
         string = f"{string.strip()}\n"
@@ -77,13 +162,16 @@ class SocketManager:
             self.logger.error("Connection dropped unexpectedly during SEND.")
             exit(1)
 
-    def receive_struct(self, struct_format):
-        byte_struct = self.receive_bytes(struct.calcsize(struct_format))
-        if not byte_struct:
+    def receive_struct(self, struct_format, wait=False):
+        byte_count = struct.calcsize(struct_format)
+        if not (self.wait(byte_count) if wait else self.fill(byte_count)):
             return None
-        return struct.unpack(struct_format, byte_struct)
+        data = struct.unpack_from(struct_format, self.buffer, self.buffer_start)
+        self.buffer_start += byte_count
+        return data
 
     def close(self):
+        self.stop_capture()
         self.logger.info("Closing socket connection...")
         try:
             self.socket.close()
@@ -124,3 +212,95 @@ class SocketManager:
             self.socket.connect((self.ip, self.port))
         except Exception as e:
             raise e
+
+
+class ReplaySocketManager(SocketManager):
+    """
+    Feeds a capture written by SocketManager to the bot in place of a live connection.
+    In real time the chunks arrive at their recorded times. Otherwise they arrive as fast as possible,
+    and a receive times out once wherever the recorded stream paused for longer than recv_timeout,
+    so that scans interleave with the messages like on the live connection.
+    A message split across chunks never times out. The commands the bot sends are kept line by line in sent.
+    """
+
+    def __init__(self, capture_path, version, recv_timeout, realtime=False):
+        super().__init__(None, None, 0, version, recv_timeout)
+        self.realtime = realtime
+        self.records = self.read_capture(capture_path)
+        self.next_record = 0
+        self.paused_at = -1
+        self.replay_start = 0
+        self.sent = []
+
+    @staticmethod
+    def read_capture(path):
+        """
+        Returns the (seconds, chunk) records of a capture file, a truncated last record is dropped.
+        """
+        with open(path, "rb") as capture:
+            data = capture.read()
+        if not data.startswith(CAPTURE_MAGIC):
+            raise ValueError(f"{path} is not a capture file.")
+
+        records = []
+        offset = len(CAPTURE_MAGIC)
+        record_size = struct.calcsize(CAPTURE_RECORD)
+        while offset + record_size <= len(data):
+            timestamp, chunk_size = struct.unpack_from(CAPTURE_RECORD, data, offset)
+            offset += record_size
+            if offset + chunk_size > len(data):
+                break
+            records.append((timestamp, data[offset:offset + chunk_size]))
+            offset += chunk_size
+        return records
+
+    def initialize(self):
+        self.socket.close()
+        self.connected = True
+        self.logger.info(f"Replaying {len(self.records)} captured chunks"
+                         f"{' in real time' if self.realtime else ''}.")
+        self.replay_start = time.perf_counter()
+        self.send_str(f"b {self.bot_ver}")
+
+    def discard_all(self, discard_timeout=1):
+        # drop everything up to the next pause of the recorded stream
+        self.buffer_start = self.buffer_end = 0
+        while self.next_record < len(self.records):
+            self.next_record += 1
+            if self.next_record < len(self.records) and \
+                    self.records[self.next_record][0] - self.records[self.next_record - 1][0] >= discard_timeout:
+                break
+
+    def fill(self, byte_count):
+        while self.buffer_end - self.buffer_start < byte_count:
+            if self.next_record >= len(self.records):
+                self.logger.info("End of capture reached.")
+                self.connected = False
+                return False
+            timestamp, chunk = self.records[self.next_record]
+
+            if self.buffer_end == self.buffer_start:
+                if self.realtime:
+                    wait = self.replay_start + timestamp - time.perf_counter()
+                    if wait > self.recv_timeout:
+                        time.sleep(self.recv_timeout)
+                        return False
+                    time.sleep(max(wait, 0))
+                elif self.paused_at != self.next_record and self.next_record > 0 and \
+                        timestamp - self.records[self.next_record - 1][0] > self.recv_timeout:
+                    self.paused_at = self.next_record
+                    return False
+
+            if self.buffer_end + len(chunk) > len(self.buffer):
+                self.compact(self.buffer_end - self.buffer_start + len(chunk))
+            self.buffer[self.buffer_end:self.buffer_end + len(chunk)] = chunk
+            self.buffer_end += len(chunk)
+            self.next_record += 1
+        return True
+
+    def send_str(self, string):
+        self.sent.extend(string.strip().split("\n"))
+        return True
+
+    def close(self):
+        self.connected = False
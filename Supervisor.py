@@ -0,0 +1,182 @@
+"""
+Runs several bots in one process, sharing the compiled kernels and a capped pool of scan workers.
+
+Every bot keeps its own connection and network thread, its scans run on the workers of a ScanScheduler.
+Each worker runs its kernels on THREAD_CAP / worker count threads, so the bots never use more than THREAD_CAP
+threads for scanning together, instead of one full set of threads per bot process.
+Larger fleets can be split across a few processes, each with its share of the bots, workers and threads.
+
+Usage: python Supervisor.py [bot count] [process count] [worker count] [thread cap]
+"""
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numba
+
+import appleBot
+from main import IP, PORT, RETRY_INTERVAL, BOT_VERSION, RECV_TIMEOUT, SCAN_PROFILE
+from SimulationHandler import ScanConfig, SimulationHandler
+from SocketManager import SocketManager
+
+SUPERVISOR_BOTS = 4
+SUPERVISOR_PROCESSES = 1
+# total threads of all scan workers of a process, the default is one per core
+THREAD_CAP = os.cpu_count() or 1
+SCAN_WORKERS = THREAD_CAP
+# scan time share of bots by their index, bots not listed have priority 1
+BOT_PRIORITIES = {}
+
+
+class ScanScheduler:
+    """
+    Schedules the scans of several bots on a pool of worker threads, at most one scan per bot at a time.
+    The scheduling is fair by scan time: the next scan goes to the waiting bot that used the least
+    scan time divided by its priority, so a bot with priority 2 gets twice the share of a busy pool.
+    Bots added later start at the least used time of the others instead of catching up.
+    """
+
+    def __init__(self, worker_count, thread_cap):
+        self.logger = logging.getLogger(__name__)
+        self.condition = threading.Condition()
+        self.priorities = {}
+        self.used_time = {}
+        self.pending = set()
+        self.running = set()
+        self.scan_count = 0
+
+        self.worker_count = max(1, min(worker_count, thread_cap))
+        self.threads_per_worker = max(1, thread_cap // self.worker_count)
+        self.workers = [threading.Thread(target=self.worker_loop, name=f"scan-worker-{i}", daemon=True)
+                        for i in range(self.worker_count)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.logger.info(f"Started {self.worker_count} scan workers with {self.threads_per_worker} threads each.")
+
+    def add_bot(self, bot, priority=1):
+        with self.condition:
+            self.priorities[bot] = priority
+            self.used_time[bot] = min(self.used_time.values(), default=0.0)
+        bot.use_scheduler(self)
+
+    def submit(self, bot):
+        with self.condition:
+            self.pending.add(bot)
+            self.condition.notify()
+
+    def next_bot(self):
+        # called with the condition held, waits for a bot that is pending and not already scanning
+        while True:
+            ready = self.pending - self.running
+            if ready:
+                bot = min(ready, key=self.used_time.get)
+                self.pending.discard(bot)
+                self.running.add(bot)
+                return bot
+            self.condition.wait()
+
+    def worker_loop(self):
+        # the thread count of parallel kernels is set per calling thread
+        numba.set_num_threads(self.threads_per_worker)
+        while True:
+            with self.condition:
+                bot = self.next_bot()
+
+            scan_time = time.perf_counter()
+            scanned = False
+            try:
+                scanned = bot.scan_field()
+            except Exception:
+                self.logger.exception(f"Scan of player {bot.id} failed.")
+            scan_time = time.perf_counter() - scan_time
+            # a bot that could not scan is submitted again by its next change
+            rescan = scanned and bot.connection.connected and bot.has_viable_targets()
+
+            with self.condition:
+                self.running.discard(bot)
+                self.used_time[bot] += scan_time / self.priorities[bot]
+                self.scan_count += 1
+                # keep scanning while targets are left, like the scan loop of a single bot
+                if rescan:
+                    self.pending.add(bot)
+                self.condition.notify()
+
+
+class Supervisor:
+    def __init__(self, bot_count, worker_count, thread_cap):
+        self.logger = logging.getLogger(__name__)
+        self.bot_count = bot_count
+        self.config = ScanConfig.load(SCAN_PROFILE) if SCAN_PROFILE is not None else None
+
+        # concurrent launches from several workers need a thread-safe threading layer
+        if self.threading_layer() == "workqueue" and worker_count > 1:
+            self.logger.warning("The workqueue threading layer does not support concurrent kernel launches, "
+                                "install tbb or use OpenMP. Falling back to a single scan worker.")
+            worker_count = 1
+        self.scheduler = ScanScheduler(worker_count, thread_cap)
+        self.bots = []
+
+    @staticmethod
+    def threading_layer():
+        # the warmup launches the parallel kernels once, which initializes the threading layer,
+        # compile_functions does not use the bot
+        SimulationHandler(None).compile_functions()
+        try:
+            return numba.threading_layer()
+        except ValueError:
+            # no parallel kernel ran, the ahead-of-time compiled kernels are serial
+            return None
+
+    def start_bot(self, index):
+        sock_manager = SocketManager(IP, PORT, RETRY_INTERVAL, BOT_VERSION, RECV_TIMEOUT)
+        bot = appleBot.AppleBot(sock_manager, self.config)
+        self.scheduler.add_bot(bot, BOT_PRIORITIES.get(index, 1))
+        self.bots.append(bot)
+        self.logger.info(f"Bot {index} connected.")
+        while sock_manager.connected:
+            bot.loop()
+
+    def run(self):
+        self.scheduler.start()
+        # every bot connects and handles its messages on its own network thread
+        threads = [threading.Thread(target=self.start_bot, args=(index,), name=f"bot-{index}", daemon=True)
+                   for index in range(self.bot_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.logger.info(f"All bots disconnected after {self.scheduler.scan_count} scans.")
+
+
+def run_supervisor(bot_count, worker_count, thread_cap):
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)-8s] --- [%(module)-14s]: %(message)s',
+                        level=logging.INFO,
+                        force=True)
+    Supervisor(bot_count, worker_count, thread_cap).run()
+
+
+if __name__ == "__main__":
+    bot_count = int(sys.argv[1]) if len(sys.argv) > 1 else SUPERVISOR_BOTS
+    process_count = int(sys.argv[2]) if len(sys.argv) > 2 else SUPERVISOR_PROCESSES
+    worker_count = int(sys.argv[3]) if len(sys.argv) > 3 else SCAN_WORKERS
+    thread_cap = int(sys.argv[4]) if len(sys.argv) > 4 else THREAD_CAP
+
+    if process_count <= 1:
+        run_supervisor(bot_count, worker_count, thread_cap)
+    else:
+        # split bots, workers and threads evenly across the processes
+        processes = [multiprocessing.Process(target=run_supervisor,
+                                             args=(len(range(i, bot_count, process_count)),
+                                                   max(1, math.ceil(worker_count / process_count)),
+                                                   max(1, thread_cap // process_count)))
+                     for i in range(process_count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
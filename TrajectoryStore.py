@@ -0,0 +1,288 @@
+import logging
+import math
+import time
+
+from numba import njit, double, prange
+from scipy.spatial import cKDTree
+
+from GravityField import FIELD_CUTOFF, accelerate
+from PlanetClusters import FAR_FIELD_RATIO
+from utils import *
+
+# number of sample points fetched from the spatial index per requested candidate,
+# several consecutive samples of the same shot usually lie close to the target
+KD_NEIGHBOURS_PER_CANDIDATE = 16
+# shots traced per launch by interruptible builds, bounds how long an interruption waits
+TRACE_CHUNK_SHOTS = 64
+
+
+class TrajectoryStore:
+    """
+    Keeps the sampled paths of a fan of shots fired from our own position.
+    A trajectory only depends on the start position, the planets, the angle and the velocity, so the fan
+    can be reused for any target until one of those changes.
+    Traced fans are additionally kept in cache (a FanCache) if one is given.
+    """
+
+    def __init__(self, angle_list, velocity_list, cache=None):
+        self.logger = logging.getLogger(__name__)
+        self.cache = cache
+
+        self.angle_list = np.asarray(angle_list, dtype=np.float64)
+        self.velocity_list = np.asarray(velocity_list, dtype=np.float64)
+        self.shot_count = self.angle_list.size * self.velocity_list.size
+
+        # one sample point per segment (plus start and end point) for every shot in the fan
+        self.points = np.zeros(dtype=np.float32, shape=(self.shot_count, MAX_SEGMENTS + 1, 2))
+        self.lengths = np.zeros(dtype=np.int32, shape=(self.shot_count,))
+
+        # field state the fan was computed for
+        self.start_position = np.zeros(dtype=np.float64, shape=(2,))
+        self.planet_positions = np.zeros(dtype=np.float64, shape=(0, 2))
+        self.planet_radii = np.zeros(dtype=np.float64, shape=(0,))
+        self.planet_masses = np.zeros(dtype=np.float64, shape=(0,))
+        self.valid = False
+        # shots traced so far, an interrupted build resumes from here for the same field state
+        self.traced_count = 0
+
+        # spatial index over all sample points, built lazily on the first query
+        self.tree = None
+        self.point_shots = np.zeros(dtype=np.int32, shape=(0,))
+        self.point_steps = np.zeros(dtype=np.int32, shape=(0,))
+
+    def matches(self, start_position, planet_positions, planet_radii, planet_masses):
+        return (self.start_position == start_position).all() and \
+            np.array_equal(self.planet_positions, planet_positions) and \
+            np.array_equal(self.planet_radii, planet_radii) and \
+            np.array_equal(self.planet_masses, planet_masses)
+
+    def invalidate(self):
+        self.valid = False
+        self.tree = None
+
+    def build(self, planet_positions, planet_radii, planet_masses, acceleration, near,
+              clusters, cluster_bounds, cluster_members, start_position, interrupted=None):
+        # returns the number of integrated steps, with interrupted the fan is traced in chunks and continues
+        # where it stopped on the next build, interruptible builds do not use the cache
+        build_time = time.time()
+
+        if interrupted is not None and self.traced_count and \
+                self.matches(start_position, planet_positions, planet_radii, planet_masses):
+            return self.trace_chunks(acceleration, near, clusters, cluster_bounds, cluster_members, interrupted)
+
+        self.start_position[:] = start_position
+        self.planet_positions = planet_positions.copy()
+        self.planet_radii = planet_radii.copy()
+        self.planet_masses = planet_masses.copy()
+        self.tree = None
+        self.traced_count = 0
+
+        if interrupted is not None:
+            return self.trace_chunks(acceleration, near, clusters, cluster_bounds, cluster_members, interrupted)
+
+        cache_key = None
+        if self.cache is not None:
+            # the field shape, the clusters and their accuracy settings tell approximated fans apart from exact ones
+            settings = acceleration.shape + (MAX_SEGMENTS, SEGMENT_STEPS, FIELD_CUTOFF, FAR_FIELD_RATIO)
+            cache_key = self.cache.key(self.start_position, self.planet_positions, self.planet_radii,
+                                       self.planet_masses, self.angle_list, self.velocity_list,
+                                       clusters, np.asarray(settings, dtype=np.float64))
+            if self.cache.load(cache_key, self.points, self.lengths):
+                self.valid = True
+                self.logger.info(f"Loaded shot fan from cache in {round(time.time() - build_time, 3):04}s")
+                return 0
+
+        self.logger.info(f"Tracing shot fan ({self.shot_count} shots)...")
+
+        # trace the whole (velocity, angle) grid in a single parallel launch
+        steps = trace_grid(planet_positions=self.planet_positions,
+                           planet_radii=self.planet_radii,
+                           planet_masses=self.planet_masses,
+                           acceleration=acceleration,
+                           near=near,
+                           clusters=clusters,
+                           cluster_bounds=cluster_bounds,
+                           cluster_members=cluster_members,
+                           start_position=self.start_position,
+                           angle_list=self.angle_list,
+                           velocity_list=self.velocity_list,
+                           points=self.points,
+                           lengths=self.lengths)
+        self.traced_count = self.shot_count
+        self.valid = True
+
+        build_time = time.time() - build_time
+        self.logger.info(f"Tracing took {round(build_time, 3):04}s")
+
+        if cache_key is not None:
+            self.cache.save(cache_key, self.points, self.lengths)
+        return steps
+
+    def trace_chunks(self, acceleration, near, clusters, cluster_bounds, cluster_members, interrupted):
+        # shots are stored velocity-major, so a chunk of consecutive angles of one velocity is a contiguous slice
+        steps = 0
+        while self.traced_count < self.shot_count:
+            if interrupted():
+                return steps
+            row, first = divmod(self.traced_count, self.angle_list.size)
+            last = min(first + TRACE_CHUNK_SHOTS, self.angle_list.size)
+            steps += trace_grid(planet_positions=self.planet_positions,
+                                planet_radii=self.planet_radii,
+                                planet_masses=self.planet_masses,
+                                acceleration=acceleration,
+                                near=near,
+                                clusters=clusters,
+                                cluster_bounds=cluster_bounds,
+                                cluster_members=cluster_members,
+                                start_position=self.start_position,
+                                angle_list=self.angle_list[first:last],
+                                velocity_list=self.velocity_list[row:row + 1],
+                                points=self.points[self.traced_count:self.traced_count + last - first],
+                                lengths=self.lengths[self.traced_count:self.traced_count + last - first])
+            self.traced_count += last - first
+        self.valid = True
+        return steps
+
+    def build_index(self):
+        index_time = time.time()
+
+        # flatten all valid sample points and tag them with their shot and segment
+        mask = np.arange(MAX_SEGMENTS + 1)[np.newaxis, :] < self.lengths[:, np.newaxis]
+        self.point_shots, self.point_steps = np.nonzero(mask)
+        self.point_shots = self.point_shots.astype(np.int32)
+        self.point_steps = self.point_steps.astype(np.int32)
+        self.tree = cKDTree(self.points[mask].astype(np.float64))
+
+        index_time = time.time() - index_time
+        self.logger.info(f"Indexed {self.tree.n} trajectory points in {round(index_time, 3):04}s")
+
+    def query_candidates(self, target_positions, count):
+        # up to count (angle, velocity, miss distance, segment) of distinct stored shots per row of target_positions,
+        # closest first, from a single spatial index query
+        if self.tree is None:
+            self.build_index()
+
+        neighbours = min(count * KD_NEIGHBOURS_PER_CANDIDATE, self.tree.n)
+        distances, indices = self.tree.query(target_positions, k=neighbours)
+        distances = distances.reshape((len(target_positions), neighbours))
+        indices = indices.reshape((len(target_positions), neighbours))
+
+        candidate_lists = []
+        for row in range(len(target_positions)):
+            # neighbours are sorted by distance, so the first sample of every shot is its closest one
+            shots = self.point_shots[indices[row]]
+            _, first = np.unique(shots, return_index=True)
+            first = np.sort(first)[:count]
+
+            candidate_lists.append([
+                (self.angle_list[shot % self.angle_list.size].item(),
+                 self.velocity_list[shot // self.angle_list.size].item(),
+                 distances[row, i].item(),
+                 self.point_steps[indices[row, i]].item())
+                for i, shot in zip(first, shots[first])])
+        return candidate_lists
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def trace_grid(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+               planet_radii: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               planet_masses: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               acceleration: np.ndarray,
+               near: np.ndarray,
+               clusters: np.ndarray,
+               cluster_bounds: np.ndarray,
+               cluster_members: np.ndarray,
+               start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+               angle_list: np.ndarray,
+               velocity_list: np.ndarray,
+               points: np.ndarray,
+               lengths: np.ndarray):
+    planet_radii_sq = planet_radii * planet_radii
+    planet_gravity = planet_masses * SEGMENT_STEP
+    # shots are stored velocity-major, index = velocity index * angle count + angle index
+    angle_count = angle_list.size
+    steps = 0
+    for index in prange(angle_count * velocity_list.size):
+        steps += trace_shot(planet_positions=planet_positions,
+                            planet_radii_sq=planet_radii_sq,
+                            planet_gravity=planet_gravity,
+                            acceleration=acceleration,
+                            near=near,
+                            clusters=clusters,
+                            cluster_bounds=cluster_bounds,
+                            cluster_members=cluster_members,
+                            start_position=start_position,
+                            angle=angle_list[index % angle_count],
+                            velocity=velocity_list[index // angle_count],
+                            index=index,
+                            points=points,
+                            lengths=lengths)
+    return steps
+
+
+@njit(nogil=True, cache=True)
+def trace_shot(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+               planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+               acceleration: np.ndarray,
+               near: np.ndarray,
+               clusters: np.ndarray,
+               cluster_bounds: np.ndarray,
+               cluster_members: np.ndarray,
+               start_position: np.ndarray(dtype=np.float64, shape=(2,)),
+               angle: double,
+               velocity: double,
+               index: int,
+               points: np.ndarray,
+               lengths: np.ndarray
+               ):
+    x = start_position[0]
+    y = start_position[1]
+    vx = velocity * math.cos(angle)
+    vy = velocity * -math.sin(angle)
+
+    left_source: bool = False
+    point_count: int = 1
+    points[index, 0, 0] = x
+    points[index, 0, 1] = y
+
+    for step_count in range(1, MAX_SEGMENTS * SEGMENT_STEPS + 1):
+        vx, vy, collided = accelerate(planet_positions, planet_radii_sq, planet_gravity,
+                                      acceleration, near, clusters, cluster_bounds, cluster_members,
+                                      x, y, vx, vy)
+        # collision with planet, store the final position
+        if collided:
+            points[index, point_count, 0] = x
+            points[index, point_count, 1] = y
+            lengths[index] = point_count + 1
+            return step_count
+
+        # apply speed vector, shortened to segment
+        x += vx * SEGMENT_STEP
+        y += vy * SEGMENT_STEP
+
+        # check if missile returned to its source
+        self_distance = math.sqrt((x - start_position[0]) ** 2 + (y - start_position[1]) ** 2)
+        returned = False
+        if left_source:
+            returned = self_distance <= PLAYER_SIZE
+        elif self_distance > PLAYER_SIZE + 1.0:
+            left_source = True
+
+        # check if missile is out of bounds
+        out_of_bounds = x < -MARGIN or \
+            x > BATTLE_FIELD_W + MARGIN or \
+            y < -MARGIN or \
+            y > BATTLE_FIELD_H + MARGIN
+
+        # sample once per segment and at the end of the trajectory
+        if returned or out_of_bounds or step_count % SEGMENT_STEPS == 0:
+            points[index, point_count, 0] = x
+            points[index, point_count, 1] = y
+            point_count += 1
+            if returned or out_of_bounds:
+                break
+
+    # the last sample is the end of the trajectory, also if the missile trail is too long
+    lengths[index] = point_count
+    return step_count
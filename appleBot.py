@@ -1,6 +1,8 @@
 import logging
 import math
 import random
+import struct
+import threading
 import time
 
 from SimulationHandler import SimulationHandler
@@ -22,11 +24,14 @@ NAMES = [
 
 
 class AppleBot:
-    def __init__(self, socket_manager):
+    def __init__(self, socket_manager, config=None):
         self.logger = logging.getLogger(__name__)
+        self.start_time = time.time()
+        self.first_scan = True
 
-        # Set up SimulationHandler and precompile functions
-        self.simulation = SimulationHandler(self)
+        # Set up SimulationHandler and precompile functions, config is a ScanConfig or None for the defaults
+        self.simulation = SimulationHandler(self, config)
+        self.metrics = self.simulation.metrics
         self.simulation.compile_functions()
 
         # Set uo ConnectionHandler and initialize connection
@@ -43,6 +48,15 @@ class AppleBot:
 
         self.last_name_update = time.time()
         self.update_flag = False
+        self.messages_processed = 0
+
+        # concurrent mode, the network thread handles messages while a worker thread
+        # or the shared workers of a ScanScheduler scan
+        self.state_lock = threading.Lock()
+        self.scan_worker = None
+        self.scheduler = None
+        self.scan_wakeup = threading.Event()
+        self.scan_targets = []
 
     def update_simulation(self):
         if self.id == -1:
@@ -70,11 +84,22 @@ class AppleBot:
 
         # recv timed out
         if struct_data is None:
+            self.metrics.count("receive_timeouts")
             return False
 
         # unpack struct
         msg_type, payload = struct_data
 
+        start_time = time.perf_counter()
+        with self.state_lock:
+            handled = self.handle_message(msg_type, payload, log)
+            self.messages_processed += handled
+        self.metrics.observe("message_seconds", time.perf_counter() - start_time, type=msg_type)
+        return handled
+
+    def handle_message(self, msg_type, payload, log=False):
+        # the data of a message follows its header, all reads wait for it and only fail if the connection ended
+
         # bot has joined
         if msg_type == 1:
             self.id = payload
@@ -94,7 +119,10 @@ class AppleBot:
 
         # player joined/moved
         elif msg_type == 3:
-            x, y = self.connection.receive_struct("ff")
+            position = self.connection.receive_struct("ff", wait=True)
+            if position is None:
+                return False
+            x, y = position
             if payload not in self.players:
                 self.logger.info(f"RECV: Player {payload} joined the game at ({round(x)},{round(y)})")
                 if payload != self.id:
@@ -122,14 +150,15 @@ class AppleBot:
 
         # shot begin
         elif msg_type == 5:
-            _, _ = self.connection.receive_struct("dd")
+            if self.connection.receive_struct("dd", wait=True) is None:
+                return False
 
         # shot end
         elif msg_type == 6:
-            #  discard all shot data
-            _, _, length = self.connection.receive_struct("ddI")
-            for i in range(length):
-                _ = self.connection.receive_struct("ff")
+            #  discard all shot data in one go
+            shot_end = self.connection.receive_struct("ddI", wait=True)
+            if shot_end is None or not self.connection.skip(shot_end[2] * struct.calcsize("ff"), wait=True):
+                return False
 
         # game mode, deprecated
         elif msg_type == 7:
@@ -139,17 +168,23 @@ class AppleBot:
 
         # own energy
         elif msg_type == 8:
-            self.energy = math.floor(self.connection.receive_struct("d")[0])
+            energy = self.connection.receive_struct("d", wait=True)
+            if energy is None:
+                return False
+            self.energy = math.floor(energy[0])
 
         # planet pos
         elif msg_type == 9:
             # discard planet byte count
-            self.connection.receive_struct("I")
-
-            self.planets = []
-            for i in range(payload):
-                x, y, radius, mass = self.connection.receive_struct("dddd")
-                self.planets.append(Planet(x, y, radius, mass, i))
+            if self.connection.receive_struct("I", wait=True) is None:
+                return False
+
+            # decode all planets at once, each planet is x, y, radius, mass
+            planet_data = self.connection.receive_array(np.float64, payload * 4, wait=True)
+            if planet_data is None:
+                return False
+            planet_data = planet_data.reshape((payload, 4))
+            self.planets = [Planet(x, y, radius, mass, i) for i, (x, y, radius, mass) in enumerate(planet_data)]
             self.logger.info(f"RECV: Map data changed. {payload} planets received.")
             self.choose_name()
             self.update_flag = True
@@ -164,35 +199,117 @@ class AppleBot:
         return True
 
     def loop(self):
+        # concurrent mode, only handle messages and leave the scanning to the worker
+        if self.simulation.cancel_scan is not None:
+            if self.process_incoming() and self.update_flag:
+                self.notify_scan_worker()
+            return
+
         if self.process_incoming():
             return
 
         self.scan_field()
 
-    def scan_field(self):
-        possible_targets = list(set(self.opponents).difference(set(self.ignored_opponents)))
-
-        # No viable opponents found to target (any opponents still on the board haven't moved since last scan)
-        if not possible_targets:
-            return
-        # update simulation field if flag is set
-        if self.update_flag:
-            self.logger.info("Update flag set, updating field...")
-            self.simulation.update_field()
-            self.update_flag = False
-        # if field is not ready yet, return
-        elif not self.simulation.initialized:
-            return
+    def start_scan_worker(self):
+        self.simulation.cancel_scan = threading.Event()
+        self.scan_worker = threading.Thread(target=self.scan_loop, name="scan-worker", daemon=True)
+        self.scan_worker.start()
+
+    def use_scheduler(self, scheduler):
+        # concurrent mode without an own worker, the scans run on the workers of scheduler
+        self.simulation.cancel_scan = threading.Event()
+        self.scheduler = scheduler
+
+    def notify_scan_worker(self):
+        # cancel the running scan if it works on outdated positions or planets
+        with self.state_lock:
+            if self.scan_targets and self.simulation.is_outdated(self.scan_targets):
+                self.simulation.cancel_scan.set()
+        if self.scheduler is not None:
+            self.scheduler.submit(self)
+        else:
+            self.scan_wakeup.set()
+
+    def has_viable_targets(self):
+        with self.state_lock:
+            return bool(set(self.opponents).difference(set(self.ignored_opponents)))
+
+    def scan_loop(self):
+        while self.connection.connected:
+            # keep the worker alive, the network thread would stay connected without anyone scanning
+            try:
+                # sleep until the network thread reports a change, unless there are targets left to scan
+                if not self.has_viable_targets():
+                    if self.simulation.speculative_stores:
+                        self.speculate()
+                    self.scan_wakeup.wait(self.connection.recv_timeout)
+                self.scan_wakeup.clear()
+                # wait for a change instead of retrying while our own player or the field is not ready
+                if not self.scan_field():
+                    self.scan_wakeup.wait(self.connection.recv_timeout)
+            except Exception:
+                self.logger.exception("Scan failed.")
+                # retry once something changed instead of failing in a loop
+                self.scan_wakeup.wait(self.connection.recv_timeout)
+
+    def speculate(self):
+        # precompute the shot fans from our position in idle time, until the network thread reports a change
+        with self.state_lock:
+            if self.id not in self.players or not self.planets:
+                return
+            if self.update_flag:
+                self.simulation.update_field()
+                self.update_flag = False
+        self.simulation.speculate(self.scan_wakeup.is_set)
 
-        target_player = sorted(possible_targets, key=lambda x: dist(self.players[x].position, self.players[self.id].position))[0]
-        result = self.simulation.scan_for(target_player)
-        # field changed
-        if result == -2:
-            return
-        # target parameters found
-        elif result != -1:
-            self.connection.send_str(f"c\nv {result[1]}")
-            self.connection.send_str(f"{math.degrees(result[0])}")
-        self.ignored_opponents.append(target_player)
-        if not list(set(self.opponents).difference(set(self.ignored_opponents))):
-            self.logger.info("No remaining viable opponents.")
+    def scan_field(self):
+        # returns whether a scan ran, False if the field is not ready for one
+        with self.state_lock:
+            possible_targets = list(set(self.opponents).difference(set(self.ignored_opponents)))
+
+            # No viable opponents found to target (any opponents still on the board haven't moved since last scan)
+            if not possible_targets:
+                return False
+            # own player has not joined yet
+            if self.id not in self.players:
+                return False
+            # update simulation field if flag is set
+            if self.update_flag:
+                self.logger.info("Update flag set, updating field...")
+                self.simulation.update_field()
+                self.update_flag = False
+            # if field is not ready yet, return
+            elif not self.simulation.initialized:
+                return False
+
+            self.scan_targets = possible_targets
+            if self.simulation.cancel_scan is not None:
+                self.simulation.cancel_scan.clear()
+
+        # scan for all possible targets at once and fire at whichever is cheapest to hit
+        scan_time = time.perf_counter()
+        result = self.simulation.scan_opponents(possible_targets)
+        scan_time = time.perf_counter() - scan_time
+        self.metrics.observe("scan_seconds", scan_time,
+                             outcome={-1: "miss", -2: "aborted"}[result] if result in (-1, -2) else "hit")
+        if self.first_scan:
+            self.logger.info(f"Time to first scan: {round(time.time() - self.start_time, 3):04}s")
+            self.first_scan = False
+
+        with self.state_lock:
+            self.scan_targets = []
+            # field changed
+            if result == -2:
+                return True
+            # none of the targets can be hit until something moves
+            elif result == -1:
+                self.ignored_opponents.extend(possible_targets)
+            # target parameters found
+            else:
+                target_player, angle, velocity = result
+                self.connection.send_str(f"c\nv {velocity}")
+                self.connection.send_str(f"{math.degrees(angle)}")
+                self.ignored_opponents.append(target_player)
+            if not list(set(self.opponents).difference(set(self.ignored_opponents))):
+                self.logger.info("No remaining viable opponents.")
+        return True
@@ -0,0 +1,224 @@
+"""
+Reproducible benchmarks of the simulation on seeded synthetic maps.
+
+Measures the cost of a single trajectory, the broad scan throughput, the latency of scan_opponents
+scanning all opponents like the bot including the share of them hit and the scaling of the broad scan
+across thread counts.
+The results are written as JSON, so runs of different commits can be compared.
+
+Usage: python benchmark.py [seed count] [output file]
+"""
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numba
+
+import SimulationHandler
+from utils import *
+
+BENCH_SEEDS = 5
+BENCH_OUTPUT = "benchmark_results.json"
+BENCH_PLAYERS = 8
+# single shots fired per map to measure the cost of one trajectory
+BENCH_TRAJECTORIES = 50
+# shots per launch for the fine scan throughput
+BENCH_FINE_SHOTS = 500
+
+
+class BenchmarkBot:
+    """
+    Static stand-in for AppleBot, holding a seeded synthetic map. Player 0 is our own player.
+    """
+
+    def __init__(self, seed, planet_count=NUM_PLANETS, player_count=BENCH_PLAYERS):
+        planet_positions, planet_radii, planet_masses, player_positions = random_map(seed, planet_count, player_count)
+        self.id = 0
+        self.planets = [Planet(x, y, radius, mass, i) for i, ((x, y), radius, mass)
+                        in enumerate(zip(planet_positions, planet_radii, planet_masses))]
+        self.players = {pid: Player(x, y, pid) for pid, (x, y) in enumerate(player_positions)}
+        self.opponents = [pid for pid in self.players if pid != self.id]
+
+    def process_incoming(self, log=False):
+        return False
+
+
+def trajectory_cost(simulation, rng):
+    """
+    Returns the mean time of a single shot fired at all opponents at random angles and velocities,
+    including the launch, like the shots of the refinement in scan_opponents.
+    """
+    run_time = 0
+    for _ in range(BENCH_TRAJECTORIES):
+        angle_list = np.asarray([rng.uniform(0, 2 * math.pi)])
+        velocity = rng.uniform(SimulationHandler.VELOCITY_DEFAULT - 2, SimulationHandler.VELOCITY_DEFAULT + 4)
+        start_time = time.perf_counter()
+        simulation.run_scanlist_multi(simulation.bot.opponents, angle_list, velocity, first_hit=False)
+        run_time += time.perf_counter() - start_time
+    return run_time / BENCH_TRAJECTORIES
+
+
+def broad_throughput(simulation):
+    """
+    Traces the broad scan fan from scratch and returns its throughput in shots per second.
+    """
+    simulation.store.invalidate()
+    start_time = time.perf_counter()
+    simulation.update_store()
+    return simulation.store.shot_count / (time.perf_counter() - start_time)
+
+
+def fine_throughput(simulation):
+    # fine scan kernel of scan_opponents, scoring all opponents at once
+    angle_list = np.linspace(0, 2 * math.pi, BENCH_FINE_SHOTS + 1)[:-1]
+    start_time = time.perf_counter()
+    simulation.run_scanlist_multi(simulation.bot.opponents, angle_list, float(SimulationHandler.VELOCITY_DEFAULT),
+                                  first_hit=False)
+    return BENCH_FINE_SHOTS / (time.perf_counter() - start_time)
+
+
+def scan_latencies(simulation, bot):
+    """
+    Scans the opponents with scan_opponents on a prepared broad scan fan like the bot does, dropping every
+    hit target until none of the remaining ones can be hit.
+    Returns the target count, the latency and the hit target with its distance in percent of A of every scan.
+    """
+    scans = []
+    target_ids = list(bot.opponents)
+    while target_ids:
+        start_time = time.perf_counter()
+        result = simulation.scan_opponents(target_ids)
+        latency = time.perf_counter() - start_time
+        hit = result not in (-1, -2)
+        scans.append({
+            "targets": len(target_ids),
+            "target": result[0] if hit else None,
+            "distance_pct": round(dist(simulation.player_positions[bot.id],
+                                       simulation.player_positions[result[0]]) * 1000 / A) if hit else None,
+            "latency": latency,
+            "hit": hit,
+        })
+        if not hit:
+            break
+        target_ids.remove(result[0])
+    return scans
+
+
+def thread_scaling(simulation):
+    """
+    Returns the broad scan throughput for powers of two up to the available thread count.
+    """
+    thread_counts = sorted({2 ** i for i in range(int(math.log2(numba.config.NUMBA_NUM_THREADS)) + 1)} |
+                           {numba.config.NUMBA_NUM_THREADS})
+    scaling = {}
+    for thread_count in thread_counts:
+        numba.set_num_threads(thread_count)
+        scaling[thread_count] = broad_throughput(simulation)
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    return scaling
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throughput_mean(throughputs):
+    # every map fires the same number of shots, so the harmonic mean is the overall throughput
+    return len(throughputs) / sum(1 / throughput for throughput in throughputs)
+
+
+def run(seed_count):
+    # the disk cache would hide the tracing cost of the broad scan
+    SimulationHandler.FAN_CACHE = False
+
+    compile_time = time.perf_counter()
+    SimulationHandler.SimulationHandler(BenchmarkBot(0)).compile_functions()
+    compile_time = time.perf_counter() - compile_time
+
+    maps = []
+    for seed in range(seed_count):
+        bot = BenchmarkBot(seed)
+        simulation = SimulationHandler.SimulationHandler(bot)
+        simulation.update_field()
+        rng = np.random.default_rng(seed)
+        maps.append({
+            "seed": seed,
+            "trajectory_cost": trajectory_cost(simulation, rng),
+            "broad_shots_per_second": broad_throughput(simulation),
+            "fine_shots_per_second": fine_throughput(simulation),
+            "opponents": len(bot.opponents),
+            "scans": scan_latencies(simulation, bot),
+        })
+    simulation = SimulationHandler.SimulationHandler(BenchmarkBot(0))
+    simulation.update_field()
+    scaling = thread_scaling(simulation)
+
+    scans = [scan for bench_map in maps for scan in bench_map["scans"]]
+    hit_latencies = [scan["latency"] for scan in scans if scan["hit"]]
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numba": numba.__version__,
+            "threads": numba.config.NUMBA_NUM_THREADS,
+            "machine": platform.machine(),
+        },
+        "settings": {
+            "seeds": seed_count,
+            "planets": NUM_PLANETS,
+            "players": BENCH_PLAYERS,
+            "broad_shots": SimulationHandler.BROAD_STEPS * len(SimulationHandler.VELOCITY_CHANGES),
+            "field_mode": SimulationHandler.FIELD_MODE,
+            "cluster_mode": SimulationHandler.CLUSTER_MODE,
+            "adaptive_mode": SimulationHandler.ADAPTIVE_MODE,
+            "first_hit_mode": SimulationHandler.FIRST_HIT_MODE,
+        },
+        "summary": {
+            "compile_time": compile_time,
+            "trajectory_cost": float(np.mean([bench_map["trajectory_cost"] for bench_map in maps])),
+            "broad_shots_per_second": throughput_mean([bench_map["broad_shots_per_second"] for bench_map in maps]),
+            "fine_shots_per_second": throughput_mean([bench_map["fine_shots_per_second"] for bench_map in maps]),
+            "hit_rate": len(hit_latencies) / sum(bench_map["opponents"] for bench_map in maps),
+            "median_hit_latency": float(np.median(hit_latencies)) if hit_latencies else None,
+            "median_scan_latency": float(np.median([scan["latency"] for scan in scans])),
+            "thread_scaling": scaling,
+        },
+        "maps": maps,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    seed_count = int(sys.argv[1]) if len(sys.argv) > 1 else BENCH_SEEDS
+    output = sys.argv[2] if len(sys.argv) > 2 else BENCH_OUTPUT
+
+    results = run(seed_count)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    summary = results["summary"]
+    columns = [("metric", "<22", "{}"), ("value", ">14", "{}")]
+    rows = [("compile / cache load", f"{summary['compile_time']:.2f}s"),
+            ("single trajectory", f"{summary['trajectory_cost'] * 1000:.2f}ms"),
+            ("broad scan", f"{summary['broad_shots_per_second']:.0f} shots/s"),
+            ("fine scan", f"{summary['fine_shots_per_second']:.0f} shots/s"),
+            ("hit rate", f"{summary['hit_rate'] * 100:.1f}%")]
+    if summary["median_hit_latency"] is not None:
+        rows.append(("median hit latency", f"{summary['median_hit_latency'] * 1000:.1f}ms"))
+    rows.append(("median scan latency", f"{summary['median_scan_latency'] * 1000:.1f}ms"))
+    for thread_count, throughput in summary["thread_scaling"].items():
+        rows.append((f"broad scan {thread_count} threads", f"{throughput:.0f} shots/s"))
+    print_row(columns)
+    for row in rows:
+        print_row(columns, row)
+    print(f"results written to {output}")
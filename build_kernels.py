@@ -0,0 +1,86 @@
+"""
+Ahead-of-time build of the simulation kernels into the appleKernels extension module.
+
+The JIT kernels are cached on disk after the first start, an AOT build additionally removes the
+compile step from fresh deployments. AOT kernels need fixed signatures and run serially,
+they are only used if AOT_KERNELS is set in SimulationHandler.
+
+Usage: python build_kernels.py
+"""
+import inspect
+import logging
+
+import AdaptiveIntegrator
+import GravityField
+import SimulationHandler
+import TrajectoryStore
+
+AOT_MODULE = "appleKernels"
+
+PLANETS = "f8[:, :], f8[:], f8[:], f4[:, :, :], b1[:, :], f8[:, :], i4[:], f8[:, :]"
+SIGNATURES = {
+    SimulationHandler: {
+        "scan_list": f"i8({PLANETS}, f8[:], f8[:], f8[:], i8, f8, f8[:], i8[:], b1)",
+        "scan_list_multi": f"i8({PLANETS}, f8[:], f8[:, :], b1[:], f8[:], i8, f8, f8[:, :], i4[:, :], i8[:], b1)",
+    },
+    TrajectoryStore: {
+        "trace_grid": f"i8({PLANETS}, f8[:], f8[:], f8[:], f4[:, :, :], i4[:])",
+    },
+    AdaptiveIntegrator: {
+        "scan_list_adaptive": "i8(f8[:, :], f8[:], f8[:], f8[:], f8[:], f8[:], i8, f8, f8, f8[:], i8[:], b1)",
+        "scan_list_adaptive_multi": "i8(f8[:, :], f8[:], f8[:], f8[:], f8[:, :], b1[:], f8[:], i8, f8, f8, "
+                                    "f8[:, :], i4[:, :], i8[:], b1)",
+    },
+    GravityField: {
+        "compute_field": "void(f8[:, :], f8[:], f8[:], f4[:, :, :], b1[:, :])",
+    },
+}
+
+
+def build():
+    from numba.pycc import CC
+
+    cc = CC(AOT_MODULE)
+    for module, kernels in SIGNATURES.items():
+        for name, signature in kernels.items():
+            cc.export(name, signature)(getattr(module, name).py_func)
+    cc.compile()
+
+
+def install():
+    """
+    Replaces the JIT kernels with the AOT compiled ones. Returns False if the module was not built.
+    """
+    try:
+        aot_module = __import__(AOT_MODULE)
+    except ImportError:
+        return False
+
+    for module, kernels in SIGNATURES.items():
+        for name in kernels:
+            kernel = keyword_wrapper(getattr(aot_module, name), getattr(module, name))
+            # also replace the kernel in the modules that imported it by name
+            for importer in SIGNATURES:
+                if getattr(importer, name, None) is getattr(module, name):
+                    setattr(importer, name, kernel)
+            setattr(module, name, kernel)
+    return True
+
+
+def keyword_wrapper(aot_kernel, jit_kernel):
+    # AOT kernels only take positional arguments, the kernels are called with keywords everywhere
+    parameters = list(inspect.signature(jit_kernel.py_func).parameters)
+
+    def kernel(**kwargs):
+        return aot_kernel(*[kwargs[parameter] for parameter in parameters])
+
+    kernel.__name__ = jit_kernel.py_func.__name__
+    return kernel
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)-8s] --- [%(module)-14s]: %(message)s',
+                        level=logging.INFO)
+    logging.info(f"Building {AOT_MODULE}...")
+    build()
+    logging.info("done.")
@@ -0,0 +1,210 @@
+"""
+Checks the scans against reference implementations on seeded synthetic maps.
+
+scan_list and the vector kernel it replaced fire a full fan of shots at a player of every map. They have to agree
+on every hit and the 99th percentile of the relative miss distance difference has to stay within KERNEL_TOLERANCE.
+Every target scan_opponents finds unreachable is scanned again alone with scan_for, which should not hit it.
+
+Usage: python check_scans.py [seed ...]
+"""
+import logging
+import math
+import sys
+import time
+
+from numba import njit, double, prange
+
+import SimulationHandler
+from benchmark import BenchmarkBot
+from SimulationHandler import scan_list
+from utils import *
+
+# 99th percentile of the relative miss distance difference of scan_list from the vector kernel it replaced
+KERNEL_TOLERANCE = 1e-8
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def scan_list_reference(planet_positions: np.ndarray,
+                        planet_radii: np.ndarray,
+                        planet_masses: np.ndarray,
+                        start_position: np.ndarray,
+                        target_position: np.ndarray,
+                        angle_list: np.ndarray,
+                        velocity: double,
+                        results: np.ndarray):
+    for index in prange(angle_list.size):
+        simulate_shot_reference(planet_positions, planet_radii, planet_masses, start_position, target_position,
+                                angle_list[index], velocity, index, results)
+
+
+@njit(nogil=True, cache=True)
+def simulate_shot_reference(planet_positions: np.ndarray,
+                            planet_radii: np.ndarray,
+                            planet_masses: np.ndarray,
+                            start_position: np.ndarray,
+                            target_position: np.ndarray,
+                            angle: double,
+                            velocity: double,
+                            index: int,
+                            results: np.ndarray):
+    # the vector kernel simulate_shot replaced, kept for compare_kernels, with the step cap it lacked
+    position = start_position.copy()
+    speed = np.asarray([velocity * math.cos(angle),
+                        velocity * -math.sin(angle)],
+                       dtype=np.float64)
+
+    left_source: bool = False
+    t_diff = target_position - start_position
+    min_distance: float = np.sqrt(t_diff.dot(t_diff))
+
+    for _ in range(MAX_SEGMENTS * SEGMENT_STEPS):
+        for i in range(planet_positions.shape[0]):
+            # calculate vector and distance from planet to missile
+            tmp_v = planet_positions[i] - position
+            distance = np.sqrt(tmp_v.dot(tmp_v))
+
+            # collision with planet?
+            if distance <= planet_radii[i]:
+                results[index] = min_distance
+                return
+
+            # apply Newtonian Gravity, shortened to segment
+            tmp_v /= distance
+            tmp_v *= planet_masses[i] / (distance ** 2)
+            tmp_v /= SEGMENT_STEPS
+            speed += tmp_v
+
+        # apply speed vector, shortened to segment
+        position += speed / SEGMENT_STEPS
+
+        # check if missile hit target player
+        t_diff = target_position - position
+        distance = np.sqrt(t_diff.dot(t_diff))
+        min_distance = min(distance, min_distance)
+        if left_source and distance <= PLAYER_SIZE:
+            results[index] = distance
+            return
+
+        # check if missile returned to its source
+        s_diff = position - start_position
+        self_distance = np.sqrt(s_diff.dot(s_diff))
+        if left_source:
+            if self_distance <= PLAYER_SIZE:
+                results[index] = min_distance
+                return
+        elif self_distance > PLAYER_SIZE + 1.0:
+            left_source = True
+
+        # check if missile is out of bounds
+        if position[0] < -MARGIN or \
+                position[0] > BATTLE_FIELD_W + MARGIN or \
+                position[1] < -MARGIN or \
+                position[1] > BATTLE_FIELD_H + MARGIN:
+            results[index] = min_distance
+            return
+
+    results[index] = min_distance
+
+
+def compare_kernels(seed, angle_count, velocity_list=(8, 12, 16)):
+    # run times, miss distance differences and hits of scan_list and the vector kernel it replaced on a seeded map
+    planet_positions, planet_radii, planet_masses, player_positions = random_map(seed)
+    angle_list = np.linspace(0, 2 * math.pi, angle_count + 1)[:-1]
+    scalar = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    reference = np.zeros(dtype=np.float64, shape=(len(velocity_list), angle_count))
+    scalar_time = reference_time = 0
+    for row, velocity in enumerate(velocity_list):
+        start_time = time.time()
+        scan_list(planet_positions=planet_positions,
+                  planet_radii=planet_radii,
+                  planet_masses=planet_masses,
+                  **no_field_arrays(),
+                  start_position=player_positions[1],
+                  target_position=player_positions[0],
+                  angle_list=angle_list,
+                  angle_count=angle_count,
+                  velocity=float(velocity),
+                  results=scalar[row],
+                  found=np.full(dtype=np.int64, shape=(1,), fill_value=-1),
+                  first_hit=False)
+        scalar_time += time.time() - start_time
+
+        start_time = time.time()
+        scan_list_reference(planet_positions=planet_positions,
+                            planet_radii=planet_radii,
+                            planet_masses=planet_masses,
+                            start_position=player_positions[1],
+                            target_position=player_positions[0],
+                            angle_list=angle_list,
+                            velocity=float(velocity),
+                            results=reference[row])
+        reference_time += time.time() - start_time
+
+    # round-off of grazing passes is amplified along the remaining flight, so single shots can diverge
+    difference = np.abs(scalar - reference) / np.maximum(reference, 1e-9)
+    return {
+        "scalar_time": scalar_time,
+        "reference_time": reference_time,
+        "identical_share": float((scalar == reference).mean()),
+        "p99_relative_difference": float(np.percentile(difference, 99)),
+        "max_relative_difference": float(difference.max()),
+        "scalar_hits": int((scalar <= PLAYER_SIZE).sum()),
+        "reference_hits": int((reference <= PLAYER_SIZE).sum()),
+        "common_hits": int(((scalar <= PLAYER_SIZE) & (reference <= PLAYER_SIZE)).sum()),
+    }
+
+
+def check_unreachable(seed, pair_distance=None):
+    # counts the unreachable verdicts of scan_opponents on a seeded map and those scan_for still finds a hit for,
+    # with pair_distance player 2 is moved next to player 1 to compete for the same broad candidates
+    bot = BenchmarkBot(seed)
+    if pair_distance is not None:
+        bot.players[2].position[:] = bot.players[1].position + [pair_distance, 0]
+    simulation = SimulationHandler.SimulationHandler(bot)
+    simulation.update_field()
+    target_ids = list(bot.opponents)
+    while target_ids:
+        result = simulation.scan_opponents(target_ids)
+        if result in (-1, -2):
+            break
+        target_ids.remove(result[0])
+
+    false_verdicts = 0
+    for target_id in simulation.unreachable:
+        check = SimulationHandler.SimulationHandler(bot)
+        check.update_field()
+        false_verdicts += check.scan_for(target_id) not in (-1, -2)
+    return {"verdicts": len(simulation.unreachable), "false_verdicts": false_verdicts}
+
+
+if __name__ == "__main__":
+    # scan_list against the vector kernel it replaced on seeded synthetic maps, both have to agree on every hit
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    seeds = [int(arg) for arg in sys.argv[1:]] or list(range(8))
+    compare_kernels(0, 1)  # compile
+    columns = [("seed", ">4", "{}"), ("speedup", ">8", "{:.1f}x"), ("identical", ">10", "{:.1%}"),
+               ("p99 rel diff", ">13", "{:.2e}"), ("max rel diff", ">13", "{:.2e}"), ("hits", ">5", "{}"),
+               ("ref hits", ">9", "{}"), ("common", ">7", "{}")]
+    print_row(columns)
+    for seed in seeds:
+        report = compare_kernels(seed, 720)
+        print_row(columns, [seed, report['reference_time'] / report['scalar_time'], report['identical_share'],
+                            report['p99_relative_difference'], report['max_relative_difference'],
+                            report['scalar_hits'], report['reference_hits'], report['common_hits']])
+        assert report['scalar_hits'] == report['reference_hits'] == report['common_hits'], \
+            f"scan_list and the reference kernel disagree on hits for seed {seed}"
+        assert report['p99_relative_difference'] <= KERNEL_TOLERANCE, \
+            f"scan_list deviates from the reference kernel for seed {seed}"
+
+    # unreachable verdicts of scan_opponents checked against single target scans on seeded synthetic maps,
+    # once as generated and once with two targets next to each other
+    SimulationHandler.FAN_CACHE = False
+    print()
+    columns = [("seed", ">4", "{}"), ("verdicts", ">9", "{}"), ("false", ">6", "{}"),
+               ("paired verdicts", ">16", "{}"), ("paired false", ">13", "{}")]
+    print_row(columns)
+    for seed in seeds:
+        report = check_unreachable(seed)
+        paired = check_unreachable(seed, pair_distance=1.4)
+        print_row(columns, [seed, report['verdicts'], report['false_verdicts'],
+                            paired['verdicts'], paired['false_verdicts']])
@@ -1,3 +1,4 @@
+from SimulationHandler import ScanConfig
 from SocketManager import SocketManager
 import appleBot
 import cursor
@@ -10,6 +11,19 @@ PORT = 3490
 RETRY_INTERVAL = 1
 BOT_VERSION = 9
 RECV_TIMEOUT = 0.1
+# handle messages on the main thread and scan on a worker thread
+CONCURRENT_SCANS = False
+# record all received data to this file for replay.py, None disables the capture
+CAPTURE_FILE = None
+# write the metrics as JSON to this file every METRICS_INTERVAL seconds, None disables the export
+METRICS_FILE = None
+METRICS_INTERVAL = 10
+# serve the metrics over HTTP on this port at /metrics (text) and /metrics.json, None disables the endpoint
+METRICS_PORT = None
+# the endpoint only accepts local connections, "" serves it on every interface
+METRICS_HOST = "127.0.0.1"
+# scan settings written by tune.py, None uses the defaults in SimulationHandler.py
+SCAN_PROFILE = None
 
 logging.basicConfig(format='[%(asctime)s] [%(levelname)-8s] --- [%(module)-14s]: %(message)s',
                     level=logging.INFO,
@@ -19,10 +33,16 @@ if __name__ == "__main__":
     cursor.hide()
 
     # initialize connection and wait for it to establish
-    sock_manager = SocketManager(IP, PORT, RETRY_INTERVAL, BOT_VERSION, RECV_TIMEOUT)
+    sock_manager = SocketManager(IP, PORT, RETRY_INTERVAL, BOT_VERSION, RECV_TIMEOUT, CAPTURE_FILE)
 
     # initialize bot object
-    bot = appleBot.AppleBot(sock_manager)
+    bot = appleBot.AppleBot(sock_manager, ScanConfig.load(SCAN_PROFILE) if SCAN_PROFILE is not None else None)
+    if CONCURRENT_SCANS:
+        bot.start_scan_worker()
+    if METRICS_FILE is not None:
+        bot.metrics.export(METRICS_FILE, METRICS_INTERVAL)
+    if METRICS_PORT is not None:
+        bot.metrics.serve(METRICS_PORT, METRICS_HOST)
 
     # loop until connection breaks
     while sock_manager.connected:
@@ -0,0 +1,34 @@
+"""
+Replays a capture written by SocketManager (see CAPTURE_FILE in main.py) into AppleBot,
+as fast as possible or in real time, and reports the replay speed.
+
+By default the bot handles messages and scans on one thread, so a fast replay is deterministic.
+With concurrent, it scans on a worker thread like main.py with CONCURRENT_SCANS, which is only
+faithful in real time.
+
+Usage: python replay.py <capture file> [realtime] [concurrent]
+"""
+import sys
+import time
+
+import appleBot
+from main import BOT_VERSION, RECV_TIMEOUT
+from SocketManager import ReplaySocketManager
+
+if __name__ == "__main__":
+    realtime = "realtime" in sys.argv[2:]
+    sock_manager = ReplaySocketManager(sys.argv[1], BOT_VERSION, RECV_TIMEOUT, realtime)
+    bot = appleBot.AppleBot(sock_manager)
+    if "concurrent" in sys.argv[2:]:
+        bot.start_scan_worker()
+
+    replay_time = time.perf_counter()
+    while sock_manager.connected:
+        bot.loop()
+    replay_time = time.perf_counter() - replay_time
+
+    shots = sum(1 for command in sock_manager.sent if command.startswith("v "))
+    captured_time = sock_manager.records[-1][0] if sock_manager.records else 0
+    print(f"replayed:  {bot.messages_processed} messages of {captured_time:.1f}s in {replay_time:.2f}s")
+    print(f"speed:     {bot.messages_processed / replay_time:.0f} messages/s")
+    print(f"shots:     {shots}")
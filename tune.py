@@ -0,0 +1,147 @@
+"""
+Searches the scan settings of ScanConfig on seeded synthetic maps and writes a profile for SCAN_PROFILE in main.py.
+
+Every trial scans the opponents of every map with scan_opponents from a freshly traced shot fan, like the bot,
+and measures the share of opponents hit and the time to hit, the fan tracing plus the scan that hit. Of the
+trials no other trial beats in both, the profile takes the fastest one whose hit rate is within
+TUNE_HIT_RATE_SLACK of the best one.
+
+Usage: python tune.py [trial count] [seed count] [profile file]
+"""
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+import SimulationHandler
+from benchmark import BenchmarkBot, git_revision, scan_latencies
+from SimulationHandler import ScanConfig
+from utils import print_row
+
+TUNE_TRIALS = 24
+TUNE_SEEDS = 4
+TUNE_OUTPUT = "scan_profile.json"
+TUNE_RANDOM_SEED = 0
+# give up this much hit rate for a faster profile
+TUNE_HIT_RATE_SLACK = 0.02
+# values sampled for every setting, the defaults always run as the first trial
+SEARCH_SPACE = {
+    "velocity_default": [10, 12, 14],
+    "velocity_changes": [[0], [0, 2, -2], [0, 2, -1, 1, -2], [0, 2, -1, 1, -2, 3, 4],
+                         [0, 1, -1, 2, -2, 3, -3, 4, -4]],
+    "broad_steps": [30, 45, 60, 90, 120],
+    "broad_test_candidates": [1, 2, 3, 5],
+    "broad_distance_max": [None, 25, 50, 100],
+    "fine_steps": [6, 8, 12, 16, 24],
+}
+
+
+def sample_configs(trial_count, rng):
+    configs = [ScanConfig()]
+    seen = {json.dumps(configs[0].to_dict())}
+    while len(configs) < min(trial_count, np.prod([len(values) for values in SEARCH_SPACE.values()])):
+        config = ScanConfig(**{name: values[rng.integers(len(values))] for name, values in SEARCH_SPACE.items()})
+        if json.dumps(config.to_dict()) not in seen:
+            seen.add(json.dumps(config.to_dict()))
+            configs.append(config)
+    return configs
+
+
+def evaluate(config, seeds):
+    """
+    Scans the opponents of the seeded maps with config. Returns the share of opponents hit, the median time
+    to hit and the mean time of a scan including its share of the fan tracing.
+    """
+    opponent_count = 0
+    scan_count = 0
+    total_time = 0.0
+    hit_times = []
+    for seed in seeds:
+        bot = BenchmarkBot(seed)
+        simulation = SimulationHandler.SimulationHandler(bot, config)
+        simulation.update_field()
+        build_time = time.perf_counter()
+        simulation.update_store()
+        build_time = time.perf_counter() - build_time
+        total_time += build_time
+
+        opponent_count += len(bot.opponents)
+        for scan in scan_latencies(simulation, bot):
+            total_time += scan["latency"]
+            scan_count += 1
+            if scan["hit"]:
+                hit_times.append(build_time + scan["latency"])
+    return {
+        "hit_rate": len(hit_times) / opponent_count,
+        "time_to_hit": float(np.median(hit_times)) if hit_times else float("inf"),
+        "scan_time": total_time / scan_count,
+    }
+
+
+def pareto_front(trials):
+    """
+    Returns the trials that no other trial beats in both hit rate and time to hit.
+    """
+    return [trial for trial in trials
+            if not any(other["hit_rate"] >= trial["hit_rate"] and other["time_to_hit"] <= trial["time_to_hit"] and
+                       (other["hit_rate"] > trial["hit_rate"] or other["time_to_hit"] < trial["time_to_hit"])
+                       for other in trials)]
+
+
+def choose(front):
+    best_hit_rate = max(trial["hit_rate"] for trial in front)
+    return min((trial for trial in front if trial["hit_rate"] >= best_hit_rate - TUNE_HIT_RATE_SLACK),
+               key=lambda trial: trial["time_to_hit"])
+
+
+def run(trial_count, seed_count):
+    SimulationHandler.FAN_CACHE = False
+    SimulationHandler.SimulationHandler(BenchmarkBot(0)).compile_functions()
+
+    seeds = range(seed_count)
+    trials = []
+    columns = [("trial", ">5", "{}"), ("hit rate", ">9", "{:.1%}"), ("time to hit", ">12", "{:.1f}ms"),
+               ("scan time", ">10", "{:.1f}ms"), (" settings", "", " {}")]
+    print_row(columns)
+    for index, config in enumerate(sample_configs(trial_count, np.random.default_rng(TUNE_RANDOM_SEED))):
+        trial = {"config": config, **evaluate(config, seeds)}
+        trials.append(trial)
+        print_row(columns, [index, trial['hit_rate'], trial['time_to_hit'] * 1000, trial['scan_time'] * 1000,
+                            config.to_dict()])
+
+    front = pareto_front(trials)
+    chosen = choose(front)
+    print("\nPareto front, * marks the chosen trial:")
+    columns = [("", "1", "{}"), ("hit rate", ">9", "{:.1%}"), ("time to hit", ">12", "{:.1f}ms"),
+               (" settings", "", " {}")]
+    print_row(columns)
+    for trial in sorted(front, key=lambda trial: trial["time_to_hit"]):
+        print_row(columns, ["*" if trial is chosen else "", trial['hit_rate'], trial['time_to_hit'] * 1000,
+                            trial['config'].to_dict()])
+    return {
+        "settings": chosen["config"].to_dict(),
+        "tuning": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "trials": len(trials),
+            "seeds": seed_count,
+            "hit_rate": chosen["hit_rate"],
+            "time_to_hit": chosen["time_to_hit"],
+            "default_hit_rate": trials[0]["hit_rate"],
+            "default_time_to_hit": trials[0]["time_to_hit"],
+        },
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    trial_count = int(sys.argv[1]) if len(sys.argv) > 1 else TUNE_TRIALS
+    seed_count = int(sys.argv[2]) if len(sys.argv) > 2 else TUNE_SEEDS
+    output = sys.argv[3] if len(sys.argv) > 3 else TUNE_OUTPUT
+
+    profile = run(trial_count, seed_count)
+    with open(output, "w") as output_file:
+        json.dump(profile, output_file, indent=2)
+    print(f"\nWrote profile to {output}, set SCAN_PROFILE in main.py to use it.")
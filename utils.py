@@ -1,10 +1,131 @@
+import math
+
 import numpy as np
+from numba import njit
+
+# BATTLEFIELD SETTINGS
+A = 2e6
+BATTLE_FIELD_W: float = math.sqrt(A * 16 / 9)
+BATTLE_FIELD_H: float = math.sqrt(A * 9 / 16)
+PLAYER_SIZE: float = 4
+MARGIN: int = 500
+
+# default map size of synthetic maps and warmups, the simulation is sized to the actual map
+NUM_PLANETS: int = 24
+MAX_PLAYERS: int = 12
+MAX_SEGMENTS: int = 2000
+SEGMENT_STEPS: int = 25
+SEGMENT_STEP: float = 1 / SEGMENT_STEPS
+# shots cancelled in first hit mode poll the hit flag every FIRST_HIT_POLL_STEPS steps of SEGMENT_STEP
+FIRST_HIT_POLL_STEPS: int = SEGMENT_STEPS
 
 
 def dist(loc1, loc2):
     return np.sqrt(np.dot(loc1 - loc2, loc1 - loc2))
 
 
+@njit(nogil=True, cache=True)
+def apply_gravity(planet_positions: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS, 2)),
+                  planet_radii_sq: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  planet_gravity: np.ndarray(dtype=np.float64, shape=(NUM_PLANETS,)),
+                  x: float, y: float, vx: float, vy: float):
+    """
+    Adds the gravity of all planets, shortened to segment, to the speed of a missile at (x, y).
+    planet_radii_sq holds the squared radii, planet_gravity the masses divided by SEGMENT_STEPS.
+    Returns the new speed and whether the missile collided with a planet.
+    """
+    for i in range(planet_positions.shape[0]):
+        # vector and squared distance from missile to planet
+        dx = planet_positions[i, 0] - x
+        dy = planet_positions[i, 1] - y
+        distance_sq = dx * dx + dy * dy
+
+        # collision with planet?
+        if distance_sq <= planet_radii_sq[i]:
+            return vx, vy, True
+
+        # apply Newtonian Gravity along the normalized vector
+        factor = planet_gravity[i] / (distance_sq * math.sqrt(distance_sq))
+        vx += dx * factor
+        vy += dy * factor
+    return vx, vy, False
+
+
+def no_field_arrays():
+    # kernel arguments for plain summation over all planets, without gravity field or planet clusters
+    return {
+        "acceleration": np.zeros(dtype=np.float32, shape=(0, 0, 2)),
+        "near": np.zeros(dtype=np.bool_, shape=(0, 0)),
+        "clusters": np.zeros(dtype=np.float64, shape=(0, 4)),
+        "cluster_bounds": np.zeros(dtype=np.int32, shape=(1,)),
+        "cluster_members": np.zeros(dtype=np.float64, shape=(0, 4)),
+    }
+
+
+def print_row(columns, values=None):
+    # prints one line of a report table, columns are (title, alignment and width, format template),
+    # without values the line holds the titles
+    cells = [title for title, _, _ in columns] if values is None else \
+        [template.format(value) for (_, _, template), value in zip(columns, values)]
+    print(" ".join(f"{cell:{spec}}" for cell, (_, spec, _) in zip(cells, columns)).rstrip())
+
+
+def random_map(seed, planet_count=NUM_PLANETS, player_count=MAX_PLAYERS):
+    """
+    Generates a seeded synthetic map with planet masses proportional to their area and players
+    placed on free ground. Returns planet positions, radii, masses and player positions.
+    """
+    rng = np.random.default_rng(seed)
+    planet_positions = np.column_stack((rng.uniform(0, BATTLE_FIELD_W, planet_count),
+                                        rng.uniform(0, BATTLE_FIELD_H, planet_count)))
+    planet_radii = rng.uniform(5, 40, planet_count)
+    planet_masses = planet_radii ** 2 * rng.uniform(5, 20, planet_count)
+
+    player_positions = np.zeros(dtype=np.float64, shape=(player_count, 2))
+    for pid in range(player_count):
+        while True:
+            position = np.asarray([rng.uniform(0, BATTLE_FIELD_W), rng.uniform(0, BATTLE_FIELD_H)])
+            distances = np.sqrt(((planet_positions - position) ** 2).sum(axis=1))
+            if (distances > planet_radii + 2 * PLAYER_SIZE).all():
+                break
+        player_positions[pid] = position
+    return planet_positions, planet_radii, planet_masses, player_positions
+
+
+def golden_section_search(function, lower, upper, tolerance, max_iterations):
+    """
+    Minimizes function(x) -> (value, result) on [lower, upper] and stops early as soon as result is not None.
+    Returns (x, value, result) of the best evaluated point.
+    """
+    inv_phi = (math.sqrt(5) - 1) / 2
+    x1 = upper - inv_phi * (upper - lower)
+    x2 = lower + inv_phi * (upper - lower)
+    f1, r1 = function(x1)
+    if r1 is not None:
+        return x1, f1, r1
+    f2, r2 = function(x2)
+    if r2 is not None:
+        return x2, f2, r2
+
+    for _ in range(max_iterations):
+        if upper - lower <= tolerance:
+            break
+        if f1 < f2:
+            upper, x2, f2 = x2, x1, f1
+            x1 = upper - inv_phi * (upper - lower)
+            f1, r1 = function(x1)
+            if r1 is not None:
+                return x1, f1, r1
+        else:
+            lower, x1, f1 = x1, x2, f2
+            x2 = lower + inv_phi * (upper - lower)
+            f2, r2 = function(x2)
+            if r2 is not None:
+                return x2, f2, r2
+
+    return (x1, f1, None) if f1 < f2 else (x2, f2, None)
+
+
 class Player:
     def __init__(self, x, y, pid):
         self.position = np.asarray([x, y], dtype=np.float64)